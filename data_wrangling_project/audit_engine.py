@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: audit_engine.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Run any number of audits over an osm file in a single streaming pass.
+
+Every audit is a visitor class derived from Audit and registered under a
+short name with the register decorator:
+    - TAGS lists the element tags the audit wants to see; None means every
+      element in the file (used by the tag counter)
+    - visit(elem) is called with each element once it is completely parsed;
+      elem is an ElementTree element or, with the expat backend, an
+      osm_parser.OsmRecord, whose children are read with the accessors of
+      osm_parser.py
+    - result() returns whatever the audit collected
+
+The built-in audits live in tag_count.py, position_range.py,
+audit_street_name.py and audit_postcode.py; audit_osm.py is the command line
+front end that runs any subset of them.
+"""
+import osm_parser
+
+# registered audit classes, keyed by name
+AUDITS = {}
+
+
+def register(name):
+    """Class decorator registering an Audit subclass under name.
+
+    :name: name used to select the audit, e.g. from the command line
+    :returns: the decorator
+
+    """
+    def decorator(cls):
+        AUDITS[name] = cls
+        return cls
+    return decorator
+
+
+class Audit(object):
+    """Base class of all audits run by run_audits."""
+
+    # tags of the elements passed to visit, None for all elements
+    TAGS = ("node", "way")
+
+    def visit(self, elem):
+        """Collect information from elem.
+
+        :elem: xml.etree.ElementTree.Element object or
+               osm_parser.OsmRecord, fully parsed
+        """
+        raise NotImplementedError
+
+    def result(self):
+        """Return the audit result."""
+        raise NotImplementedError
+
+
+def run_audits(osm_file, audits, backend="etree"):
+    """Parse osm_file once and feed every element to the audits asking for it.
+
+    :osm_file: osm file name (possibly compressed, see osm_io.py) or
+               file object
+    :audits: a list of Audit objects
+    :backend: parser backend, "etree" or "expat" (see osm_parser.py)
+    :returns: a list with the result of each audit, in the same order
+
+    """
+    everything = [audit for audit in audits if audit.TAGS is None]
+    by_tag = {}
+    for audit in audits:
+        if audit.TAGS is not None:
+            for tag in audit.TAGS:
+                by_tag.setdefault(tag, []).append(audit)
+
+    # elements are only cleared after all audits have seen them
+    for elem in osm_parser.parse(osm_file, None, backend):
+        for audit in everything:
+            audit.visit(elem)
+        for audit in by_tag.get(elem.tag, ()):
+            audit.visit(elem)
+
+    return [audit.result() for audit in audits]
+
+
+def run_registered(osm_file, names=None, backend="etree"):
+    """Run the registered audits selected by names in one pass.
+
+    :osm_file: osm file name or file object
+    :names: names of the audits to run, all registered audits if None
+    :backend: parser backend, see run_audits
+    :returns: a dict with audit name as key and audit result as value
+
+    """
+    if names is None:
+        names = sorted(AUDITS)
+
+    unknown = [name for name in names if name not in AUDITS]
+    if unknown:
+        raise ValueError("Unknown audit(s): {}".format(", ".join(unknown)))
+
+    results = run_audits(osm_file, [AUDITS[name]() for name in names],
+                         backend)
+    return dict(zip(names, results))
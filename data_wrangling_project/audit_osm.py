@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: audit_osm.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Run several audits over an osm file with a single pass over the file.
+Available audits:
+    - tags: count different types of tags (tag_count.py)
+    - position: range and statistics of lattitude and longitude
+      (position_range.py)
+    - street: street type, direction and digits (audit_street_name.py)
+    - postcode: different postcodes (audit_postcode.py)
+
+Usage:
+    python audit_osm.py dallas.osm                    # run all audits
+    python audit_osm.py dallas.osm street postcode    # run a subset
+    python audit_osm.py dallas.osm --backend expat    # faster parser
+    python audit_osm.py dallas.osm --cache .stage_cache
+"""
+import argparse
+import pprint
+import sys
+
+import audit_engine
+import osm_parser
+import stage_cache
+
+# importing the audit modules registers their audits
+import tag_count
+import position_range
+import audit_street_name
+import audit_postcode
+
+
+def main(osm_file, names=None, backend="etree", cache_dir=None):
+    def run():
+        return audit_engine.run_registered(osm_file, names, backend)
+
+    if cache_dir is None:
+        results = run()
+    else:
+        modules = [sys.modules[__name__], audit_engine, tag_count,
+                   position_range, audit_street_name, audit_postcode]
+        modules += stage_cache.reader_modules()
+        key = stage_cache.make_key("audit_osm", [osm_file],
+                {"audits": sorted(names or audit_engine.AUDITS)},
+                [stage_cache.code_version(*modules)])
+        results, _ = stage_cache.StageCache(cache_dir).run(key, run)
+
+    for name in results:
+        print("=" * 20, name, "=" * 20)
+        pprint.pprint(results[name])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description="Run audits over an osm file in a single pass.")
+    parser.add_argument("osm_file")
+    parser.add_argument("audits", nargs="*", metavar="audit",
+            help="audits to run: {} (default: all)".format(
+                ", ".join(sorted(audit_engine.AUDITS))))
+    parser.add_argument("--backend", choices=osm_parser.BACKENDS,
+            default="etree", help="xml parser backend (default: etree)")
+    parser.add_argument("--cache", metavar="DIR",
+            help="reuse the results of a previous run on the same input "
+                 "cached in DIR (see stage_cache.py)")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.audits if name not in audit_engine.AUDITS]
+    if unknown:
+        parser.error("unknown audit(s): {}".format(", ".join(unknown)))
+
+    main(args.osm_file, args.audits or None, args.backend, args.cache)
@@ -6,11 +6,27 @@ Github: yyangbian
 Description: 
     Check postcode in the osm file
 """
-import xml.etree.cElementTree as ET
 import pprint
 
-def has_postcode(elem):
-    return (elem.attrib['k'] == "addr:postcode")
+import audit_engine
+import osm_parser
+
+
+@audit_engine.register("postcode")
+class PostcodeAudit(audit_engine.Audit):
+    """Collect the different postcodes of "node" and "way" elements."""
+
+    def __init__(self):
+        self.postcodes = set()
+
+    def visit(self, elem):
+        for k, v in osm_parser.tag_pairs(elem):
+            if k == "addr:postcode":
+                self.postcodes.add(v)
+
+    def result(self):
+        return self.postcodes
+
 
 def audit_postcode(osmfile):
     """Audit postcode in the specified osmfile.
@@ -19,18 +35,7 @@ def audit_postcode(osmfile):
     :osmfile: osm file
     :returns: a set of different postcode from osm file
     """
-
-    osm_file = open(osmfile, "r", encoding="utf-8")
-    postcodes = set()
-    for event, elem in ET.iterparse(osm_file, events=("start",)):
-        if elem.tag == "node" or elem.tag == "way":
-            for tag in elem.iter("tag"):
-                if has_postcode(tag):
-                    postcodes.add(tag.attrib['v'])
-
-        elem.clear()
-
-    return postcodes
+    return audit_engine.run_audits(osmfile, [PostcodeAudit()])[0]
 
 def main(osmfile):
     audit_results = audit_postcode(osmfile)
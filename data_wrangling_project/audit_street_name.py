@@ -14,11 +14,13 @@ Audit "v" value in "tag" with "k" value equal to "addr:street".
     under "direction" category.
   - If "v" value has numbers in it. It is displayed under "digits" category.
 """
-import xml.etree.cElementTree as ET
 from collections import defaultdict
 import re
 import pprint
 
+import audit_engine
+import osm_parser
+
 #Street type is the non-white-space string at the end
 street_type_re = re.compile(r'\b\S+\.?\s*$')
 
@@ -71,10 +73,29 @@ def audit_street_with_digits(street_with_digits, street_name):
         digits = m.group()
         street_with_digits[digits].add(street_name)
 
-def is_street_name(elem):
-    '''True if the elem attribute "k" value is "addr:street"
-    '''
-    return (elem.attrib['k'] == "addr:street")
+
+@audit_engine.register("street")
+class StreetNameAudit(audit_engine.Audit):
+    """Check street type, direction and numbers of "addr:street" tags."""
+
+    def __init__(self):
+        self.street_types = defaultdict(set)
+        self.street_directions = defaultdict(set)
+        self.street_with_digits = defaultdict(set)
+
+    def visit(self, elem):
+        for k, v in osm_parser.tag_pairs(elem):
+            if k == "addr:street":
+                audit_street_type(self.street_types, v)
+                audit_street_direction(self.street_directions, v)
+                audit_street_with_digits(self.street_with_digits, v)
+
+    def result(self):
+        return {
+                "type"      : self.street_types,
+                "direction" : self.street_directions,
+                "digits"    : self.street_with_digits
+                }
 
 
 def audit(osmfile):
@@ -89,27 +110,7 @@ def audit(osmfile):
               'direction' is a dict with direction as key
               'digits' is a dict with numbers shown in the street name as key
     """
-
-    osm_file = open(osmfile, "r", encoding="utf-8")
-    street_types = defaultdict(set)
-    street_directions = defaultdict(set)
-    street_with_digits = defaultdict(set)
-    for event, elem in ET.iterparse(osm_file, events=("start",)):
-        if elem.tag == "node" or elem.tag == "way":
-            for tag in elem.iter("tag"):
-                if is_street_name(tag):
-                    audit_street_type(street_types, tag.attrib['v'])
-                    audit_street_direction(street_directions, tag.attrib['v'])
-                    audit_street_with_digits(
-                            street_with_digits, tag.attrib['v'])
-
-        elem.clear()
-
-    return {
-            "type"      : street_types,
-            "direction" : street_directions,
-            "digits"    : street_with_digits
-            }
+    return audit_engine.run_audits(osmfile, [StreetNameAudit()])[0]
 
 def main(osmfile):
     audit_results = audit(osmfile)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: benchmark_json.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Measure the json output throughput of osm_to_json on a synthetic osm file
+(see synthetic_osm.py).
+
+The elements of the file are shaped once, then written with
+    - legacy-pretty: json.dumps(el, indent=2) and one write per element,
+      the former default of process_map
+    - legacy-compact: json.dumps(el) and one write per element
+    - writer-json: json_writer.JsonWriter, compact, standard json module
+    - writer-orjson: json_writer.JsonWriter, compact, orjson (if installed)
+and the throughput is reported in MB of json written per second, along
+with the end-to-end time of process_map in its default mode.
+
+Usage:
+    python benchmark_json.py [number of nodes]
+"""
+import json
+import os
+import tempfile
+import time
+import xml.etree.cElementTree as ET
+
+import json_writer
+import osm_to_json
+import synthetic_osm
+
+
+def shape_all(osm_file):
+    """Shape all "node" and "way" elements of osm_file."""
+    elements = []
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, element in context:
+        if event == 'end' and element.tag in osm_to_json.TAGS_TO_PROCESS:
+            elements.append(osm_to_json.shape_element(element))
+            root.clear()
+    return elements
+
+
+def legacy_write(elements, path, pretty):
+    with open(path, "w", encoding="utf-8") as fo:
+        for el in elements:
+            if pretty:
+                fo.write(json.dumps(el, indent=2) + "\n")
+            else:
+                fo.write(json.dumps(el) + "\n")
+
+
+def writer_write(elements, path, fast):
+    with open(path, "wb") as fo, \
+            json_writer.JsonWriter(fo, pretty=False, fast=fast) as writer:
+        for el in elements:
+            writer.write(el)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main(n_nodes=200000):
+    with tempfile.TemporaryDirectory() as tmp:
+        osm_file = os.path.join(tmp, "synthetic.osm")
+        json_file = os.path.join(tmp, "out.json")
+        synthetic_osm.write_synthetic_osm(osm_file, n_nodes)
+        print("osm file: {:.1f} MB".format(os.path.getsize(osm_file) / 1e6))
+
+        elements = shape_all(osm_file)
+        cases = [
+                ("legacy-pretty", legacy_write, True),
+                ("legacy-compact", legacy_write, False),
+                ("writer-json", writer_write, False),
+                ]
+        if json_writer.orjson is not None:
+            cases.append(("writer-orjson", writer_write, True))
+
+        for name, func, option in cases:
+            seconds = timed(func, elements, json_file, option)
+            size = os.path.getsize(json_file) / 1e6
+            print("{:16s} {:8.1f} MB {:8.2f} s {:8.1f} MB/s".format(
+                name, size, seconds, size / seconds))
+
+        seconds = timed(osm_to_json.process_map, osm_file, json_file)
+        print("process_map: {:.2f} s, {:.1f} MB/s of osm input".format(
+            seconds, os.path.getsize(osm_file) / 1e6 / seconds))
+
+if __name__ == "__main__":
+    import sys
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: benchmark_parser.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Compare the parser backends of osm_parser.py on a synthetic osm file
+(see synthetic_osm.py).
+
+For each backend two passes are measured:
+    - parse: iterate over the top-level elements, reading their tags and
+      node references
+    - shape: osm_to_json.shape_element on every "node" and "way"
+and reported as seconds per million top-level elements, peak memory
+allocated by Python while parsing (tracemalloc, measured in a separate run
+since tracing slows the parser down) and the number of generation 0
+garbage collections, which grows with the number of objects allocated.
+
+Finally the memory taken by a list of all the top-level elements is
+reported for each backend, as an in-memory stage would hold them.
+
+Usage:
+    python benchmark_parser.py [number of nodes]
+"""
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+import osm_parser
+import osm_to_json
+import synthetic_osm
+
+
+def parse_pass(osm_file, backend):
+    """Parse osm_file and read the children of every element.
+
+    :returns: number of top-level elements
+    """
+    n = 0
+    for element in osm_parser.parse(osm_file, osm_parser.LEVEL_ONE_TAGS,
+                                     backend):
+        osm_parser.tag_pairs(element)
+        osm_parser.nd_refs(element)
+        n += 1
+    return n
+
+
+def shape_pass(osm_file, backend):
+    """Shape every "node" and "way" of osm_file.
+
+    :returns: number of shaped elements
+    """
+    n = 0
+    for element in osm_parser.parse(osm_file, osm_to_json.TAGS_TO_PROCESS,
+                                    backend):
+        osm_to_json.shape_element(element)
+        n += 1
+    return n
+
+
+def held_memory(osm_file, backend):
+    """Memory in MB taken by the list of all top-level elements."""
+    tracemalloc.start()
+    elements = list(osm_parser.parse(osm_file, osm_parser.LEVEL_ONE_TAGS,
+                                     backend))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del elements
+    return size / 1e6
+
+
+def measure(func, osm_file, backend):
+    """Run func(osm_file, backend).
+
+    :returns: (number of elements, seconds, gen 0 collections, peak MB)
+    """
+    collections = gc.get_stats()[0]["collections"]
+    start = time.perf_counter()
+    n = func(osm_file, backend)
+    seconds = time.perf_counter() - start
+    collections = gc.get_stats()[0]["collections"] - collections
+
+    tracemalloc.start()
+    func(osm_file, backend)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return n, seconds, collections, peak / 1e6
+
+
+def main(n_nodes=200000):
+    with tempfile.TemporaryDirectory() as tmp:
+        osm_file = os.path.join(tmp, "synthetic.osm")
+        synthetic_osm.write_synthetic_osm(osm_file, n_nodes)
+        print("osm file: {:.1f} MB".format(os.path.getsize(osm_file) / 1e6))
+        print("{:6s} {:7s} {:>12s} {:>12s} {:>10s}".format(
+            "pass", "backend", "s/M elems", "gen0 gc/M", "peak MB"))
+
+        for name, func in (("parse", parse_pass), ("shape", shape_pass)):
+            for backend in osm_parser.BACKENDS:
+                n, seconds, collections, peak = measure(func, osm_file,
+                                                        backend)
+                print("{:6s} {:7s} {:12.2f} {:12.0f} {:10.2f}".format(
+                    name, backend, seconds * 1e6 / n, collections * 1e6 / n,
+                    peak))
+
+        print("memory held by all elements:")
+        for backend in osm_parser.BACKENDS:
+            print("{:7s} {:10.1f} MB".format(backend,
+                                            held_memory(osm_file, backend)))
+
+if __name__ == "__main__":
+    import sys
+    main(*[int(arg) for arg in sys.argv[1:]])
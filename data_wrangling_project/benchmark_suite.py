@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: benchmark_suite.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Measure the throughput of the data wrangling stages on synthetic osm files
+(synthetic_osm.py) of several sizes:
+    - count_tags: tag_count.count_tags
+    - audit: all the audits of audit_osm.py in one pass
+    - clean_osm: clean_osm.clean_osm, changes counted but not written
+    - process_map: osm_to_json.process_map
+    - sample: sample_osm_file.main, every 80th element
+    - sample_seek: same through the offset index, index build included
+Each stage runs in a new process, so its peak resident memory
+(getrusage maxrss) is its own; the peak of its worker processes, if any,
+is reported separately. A stage is run --repeat times and the fastest run
+is kept.
+
+For each stage and size the results are elements per second, MB of osm
+input per second and peak RSS. They are saved as json with the Python
+version, the platform and the git commit, and can be compared with a
+previous results file to spot regressions.
+
+Usage:
+    python benchmark_suite.py --sizes 10000,100000 --output bench.json
+    python benchmark_suite.py --stages clean_osm,process_map --processes 4
+    python benchmark_suite.py --output new.json --compare bench.json
+"""
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic_osm
+
+STAGES = ["count_tags", "audit", "clean_osm", "process_map", "sample",
+          "sample_seek"]
+
+SIZES = [10000, 100000, 1000000]
+
+# a stage is reported as a regression if it is slower than this ratio of
+# the compared results
+REGRESSION_RATIO = 1.1
+
+
+def run_stage(stage, osm_file, out_dir, processes=1):
+    """Run one stage on osm_file, writing its outputs to out_dir."""
+    if stage == "count_tags":
+        import tag_count
+        tag_count.count_tags(osm_file)
+    elif stage == "audit":
+        import audit_engine
+        import audit_osm
+        audit_engine.run_registered(osm_file)
+    elif stage == "clean_osm":
+        import change_log
+        import clean_osm
+        with change_log.ChangeLog(change_log.NullSink()) as log:
+            clean_osm.clean_osm(osm_file, os.path.join(out_dir, "clean.osm"),
+                                processes, log)
+    elif stage == "process_map":
+        import osm_to_json
+        osm_to_json.process_map(osm_file, os.path.join(out_dir, "out.json"),
+                                processes=processes)
+    elif stage in ("sample", "sample_seek"):
+        import sample_osm_file
+        sample_osm_file.main(osm_file, os.path.join(out_dir, "sample.osm"),
+                             seek=stage == "sample_seek")
+    else:
+        raise ValueError("Unknown stage: {}".format(stage))
+
+
+def _maxrss_mb(who):
+    """Peak RSS in MB of this process or of its waited for children."""
+    maxrss = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def child_main(stage, osm_file, out_dir, processes):
+    """Run a stage in this (new) process and print its measures as json."""
+    start = time.perf_counter()
+    run_stage(stage, osm_file, out_dir, processes)
+    seconds = time.perf_counter() - start
+    print(json.dumps({
+        "seconds": seconds,
+        "peak_rss_mb": _maxrss_mb(resource.RUSAGE_SELF),
+        "workers_peak_rss_mb": _maxrss_mb(resource.RUSAGE_CHILDREN),
+        }))
+
+
+def measure(stage, osm_file, processes=1):
+    """Run a stage in a new process.
+
+    :returns: a dict with "seconds", "peak_rss_mb" and "workers_peak_rss_mb"
+    """
+    with tempfile.TemporaryDirectory() as out_dir:
+        output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child",
+                 stage, osm_file, out_dir, str(processes)],
+                stdout=subprocess.PIPE, check=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output.decode("utf-8").splitlines()[-1])
+
+
+def git_commit():
+    """Commit of the working tree, or None outside of a git repository."""
+    try:
+        output = subprocess.run(["git", "rev-parse", "HEAD"],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode("ascii").strip()
+
+
+def run_suite(sizes=SIZES, stages=STAGES, processes=1, repeat=1, seed=0,
+        work_dir=None, verbose=True):
+    """Benchmark stages on synthetic files with sizes nodes.
+
+    :work_dir: directory for the synthetic files, a temporary one if None
+    :returns: a results dictionary, see the module description
+
+    """
+    results = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "commit": git_commit(),
+               "processes": processes,
+               "seed": seed,
+               "runs": []}
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        for n_nodes in sizes:
+            osm_file = os.path.join(tmp, "synthetic-{}.osm".format(n_nodes))
+            counts = synthetic_osm.write_synthetic_osm(osm_file, n_nodes,
+                                                       seed=seed)
+            elements = sum(counts.values())
+            mb = os.path.getsize(osm_file) / 1e6
+
+            for stage in stages:
+                best = min((measure(stage, osm_file, processes)
+                            for _ in range(repeat)),
+                           key=lambda run: run["seconds"])
+                run = {"stage": stage,
+                       "nodes": n_nodes,
+                       "elements": elements,
+                       "mb": mb,
+                       "seconds": best["seconds"],
+                       "elements_per_s": elements / best["seconds"],
+                       "mb_per_s": mb / best["seconds"],
+                       "peak_rss_mb": best["peak_rss_mb"],
+                       "workers_peak_rss_mb": best["workers_peak_rss_mb"]}
+                results["runs"].append(run)
+                if verbose:
+                    print_run(run)
+    return results
+
+
+def print_run(run):
+    print("{:12s} {:>9d} nodes {:8.1f} MB {:8.2f} s {:>10.0f} elem/s "
+          "{:7.1f} MB/s {:8.1f} MB rss".format(
+              run["stage"], run["nodes"], run["mb"], run["seconds"],
+              run["elements_per_s"], run["mb_per_s"], run["peak_rss_mb"]),
+          file=sys.stderr)
+
+
+def compare(results, previous, ratio=REGRESSION_RATIO):
+    """Compare the runs of results with the same runs in previous.
+
+    :returns: a list of (stage, nodes, previous seconds, seconds, slower)
+              where slower is True if seconds > ratio * previous seconds
+    """
+    before = {(run["stage"], run["nodes"]): run["seconds"]
+              for run in previous["runs"]}
+    rows = []
+    for run in results["runs"]:
+        key = (run["stage"], run["nodes"])
+        if key in before:
+            rows.append(key + (before[key], run["seconds"],
+                               run["seconds"] > ratio * before[key]))
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        stage, osm_file, out_dir, processes = sys.argv[2:6]
+        child_main(stage, osm_file, out_dir, int(processes))
+        sys.exit()
+
+    def int_list(text):
+        return [int(value) for value in text.split(",")]
+
+    def stage_list(text):
+        stages = text.split(",")
+        unknown = [stage for stage in stages if stage not in STAGES]
+        if unknown:
+            raise argparse.ArgumentTypeError(
+                    "unknown stage(s): {}".format(", ".join(unknown)))
+        return stages
+
+    parser = argparse.ArgumentParser(
+            description="Benchmark the stages on synthetic osm files.")
+    parser.add_argument("--sizes", type=int_list, default=SIZES,
+            help="comma separated numbers of nodes (default: {})".format(
+                ",".join(str(size) for size in SIZES)))
+    parser.add_argument("--stages", type=stage_list, default=STAGES,
+            help="comma separated stages (default: all)")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1,
+            help="runs per stage, the fastest is kept (default: 1)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir",
+            help="directory for the synthetic files (default: system temp)")
+    parser.add_argument("--output", metavar="FILE",
+            help="save the results as json to FILE")
+    parser.add_argument("--compare", metavar="FILE",
+            help="compare with the results saved in FILE")
+    args = parser.parse_args()
+
+    results = run_suite(args.sizes, args.stages, args.processes, args.repeat,
+                        args.seed, args.work_dir)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if previous.get("processes") != results["processes"]:
+            print("warning: {} was run with {} processes".format(
+                args.compare, previous.get("processes")), file=sys.stderr)
+        regressions = 0
+        for stage, nodes, before, after, slower in compare(results, previous):
+            print("{:12s} {:>9d} nodes {:8.2f} s -> {:8.2f} s {:+6.1f}%{}"
+                  .format(stage, nodes, before, after,
+                          (after / before - 1) * 100,
+                          "  SLOWER" if slower else ""))
+            regressions += slower
+        sys.exit(1 if regressions else 0)
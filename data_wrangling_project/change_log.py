@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: change_log.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Record the tag changes made while cleaning an osm file.
+
+A ChangeLog buffers each change as a record
+    (element_type, element_id, old_k, old_v, new_k, new_v, rule)
+and hands the buffer to a sink in bulk. It also counts how often each rule
+fired. Available sinks:
+    - NullSink: keeps nothing, only the counters are updated
+    - PrintSink: prints every change to screen, the original behavior
+    - CsvSink / JsonlSink: write the records to a csv or json lines file
+open_sink picks the sink from a file name.
+"""
+from collections import Counter
+import csv
+import json
+import sys
+
+FIELDS = ["element_type", "element_id", "old_k", "old_v", "new_k", "new_v",
+          "rule"]
+
+# number of records kept in memory before they are written
+BUFFER_SIZE = 10000
+
+
+class NullSink(object):
+    """Discard all records."""
+
+    keeps_records = False
+
+    def write(self, records):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemorySink(object):
+    """Keep all records in a list, used by worker processes."""
+
+    keeps_records = True
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, records):
+        self.records.extend(records)
+
+    def close(self):
+        pass
+
+
+class PrintSink(object):
+    """Print records to a stream in the format of
+    clean_utils.display_tag_change and clean_utils.update_postcode.
+    """
+
+    keeps_records = True
+
+    MESSAGE = '{}-{}:\n<tag k="{}" v="{}"/>\n=>\n<tag k="{}" v="{}"/>\n{}\n'
+
+    INVALID_POSTCODE_MESSAGE = "Postcode {} is not correct.\n"
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def format(self, record):
+        if record[6] == "invalid_postcode":
+            return self.INVALID_POSTCODE_MESSAGE.format(record[3])
+        return self.MESSAGE.format(*record[:6] + ("="*60,))
+
+    def write(self, records):
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write("".join(self.format(record) for record in records))
+
+    def close(self):
+        pass
+
+
+class CsvSink(object):
+    """Write records to a csv file with a header row."""
+
+    keeps_records = True
+
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(FIELDS)
+
+    def write(self, records):
+        self.writer.writerows(records)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlSink(object):
+    """Write records to a file as one json object per line."""
+
+    keeps_records = True
+
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, records):
+        self.file.write("".join(json.dumps(dict(zip(FIELDS, record))) + "\n"
+                                for record in records))
+
+    def close(self):
+        self.file.close()
+
+
+def open_sink(path):
+    """Create a sink from a file name.
+
+    :path: None for a NullSink, "-" for a PrintSink, a name ending with
+           ".csv" for a CsvSink, any other name for a JsonlSink
+    :returns: a sink object
+
+    """
+    if path is None:
+        return NullSink()
+    elif path == "-":
+        return PrintSink()
+    elif path.endswith(".csv"):
+        return CsvSink(path)
+    else:
+        return JsonlSink(path)
+
+
+class ChangeLog(object):
+    """Buffer tag changes and count the rules that made them."""
+
+    def __init__(self, sink=None, buffer_size=BUFFER_SIZE):
+        self.sink = sink if sink is not None else NullSink()
+        self.buffer_size = buffer_size
+        self.records = []
+        self.counts = Counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, element, old, new, rule):
+        """Record a change of a tag.
+
+        :element: the level-one element owning the tag
+        :old: (k, v) pair before the change
+        :new: (k, v) pair after the change
+        :rule: name of the cleaning rule that made the change
+        """
+        self.counts[rule] += 1
+        if self.sink.keeps_records:
+            self.records.append((element.tag, element.attrib.get("id"),
+                                 old[0], old[1], new[0], new[1], rule))
+            if len(self.records) >= self.buffer_size:
+                self.flush()
+
+    def merge(self, records, counts):
+        """Add records and counts collected by another ChangeLog, for
+        example in a worker process.
+        """
+        self.counts.update(counts)
+        if self.sink.keeps_records:
+            self.records.extend(records)
+            if len(self.records) >= self.buffer_size:
+                self.flush()
+
+    def flush(self):
+        """Write the buffered records to the sink."""
+        if self.records:
+            self.sink.write(self.records)
+            self.records = []
+
+    def close(self):
+        self.flush()
+        self.sink.close()
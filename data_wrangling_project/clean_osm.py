@@ -33,51 +33,213 @@ Clean original osm data and generate a new osm file:
         <tag k="addr:postcode" v="Grand Prairie, TX 75052-8514"/> =>
         <tag k="addr:postcode" v="75226"/>
 """
+import os
+import sys
 import xml.etree.cElementTree as ET
 
 LEVEL_ONE_TAGS = ["node", "way", "relation", "bounds"]
 
+import change_log
 import clean_utils
+import osm_chunks
+import osm_io
+import special_cases
+import stage_cache
 
-def process_element(element):
+def process_element(element, log=None, rules=None):
     """Make changes to this element.
 
     :element: a level-one element to be processed
+    :log: change_log.ChangeLog recording the changes; if None, changes are
+          printed to screen
+    :rules: special_cases.SpecialCaseRules object, the built-in rules if None
 
     """
     if element.tag not in clean_utils.TAGS_TO_PROCESS:
         return
 
-    clean_utils.process_special_cases(element)
+    clean_utils.process_special_cases(element, log, rules)
 
-    clean_utils.process_address(element)
+    clean_utils.process_address(element, log)
 
 
-def clean_osm(osm_file, new_osm_file):
-    """Parse osm_file and create a new_osm_file with data cleaned.
+def serialize_element(element):
+    """Serialize a level-one element, followed by a new line.
+
+    The tail parsed by iterparse depends on where the parser's read buffer
+    ends, so it is replaced to make the output independent of it.
+
+    :element: a level-one element
+    :returns: utf-8 encoded bytes
+
+    """
+    element.tail = "\n"
+    return ET.tostring(element, encoding='utf-8')
+
+
+def clean_chunk(osm_file, start, end, log_changes=None, rules=None):
+    """Clean the level-one elements in a byte range of osm_file.
 
     :osm_file: original osm data file
-    :new_osm_file: new osm data file
+    :start, end: byte range from osm_chunks.find_chunks
+    :log_changes: None to print changes to screen, otherwise a bool telling
+                  if change records are kept or only counted
+    :rules: same as in process_element
+    :returns: the cleaned elements serialized the same way as clean_osm,
+              and if log_changes is not None, the change records and the
+              counts of each rule
+
+    """
+    log = None
+    if log_changes is not None:
+        sink = change_log.MemorySink() if log_changes else change_log.NullSink()
+        log = change_log.ChangeLog(sink)
+
+    output = []
+    for element in osm_chunks.iter_chunk_elements(osm_file, start, end,
+            LEVEL_ONE_TAGS):
+        process_element(element, log, rules)
+        output.append(serialize_element(element))
+
+    if log is None:
+        return b"".join(output)
+    log.flush()
+    return b"".join(output), sink.records if log_changes else [], log.counts
+
+
+def clean_osm(osm_file, new_osm_file, processes=1, log=None, rules=None,
+        cache=None):
+    """Parse osm_file and create a new_osm_file with data cleaned.
+
+    :osm_file: original osm data file, possibly compressed (see osm_io.py)
+    :new_osm_file: new osm data file, compressed according to its extension
+    :processes: number of processes to clean with. If more than one,
+                osm_file is split into byte ranges cleaned in parallel;
+                the output is identical to the one of a single process.
+                A compressed osm_file can't be split and is cleaned by a
+                single process.
+    :log: change_log.ChangeLog recording the changes; if None, changes are
+          printed to screen. The log is flushed but not closed.
+    :rules: special_cases.SpecialCaseRules object, the built-in rules if None
+    :cache: stage_cache.StageCache object; if given, the byte ranges cleaned
+            in parallel are cached, so only the ranges that changed since
+            a previous run are cleaned again
 
     """
-    with open(new_osm_file, 'wb') as output:
+    if osm_io.is_compressed(osm_file):
+        processes = 1
+
+    # workers would print their changes in the order they finish, so their
+    # records are sent back and printed here in file order
+    print_log = None
+    if processes > 1 and log is None:
+        log = print_log = change_log.ChangeLog(change_log.PrintSink())
+
+    func, args = clean_chunk, ()
+    if cache is not None and processes > 1:
+        version = stage_cache.make_key("clean_osm.chunk",
+                options={"log_changes": log.sink.keeps_records},
+                versions=[stage_cache.rules_version(rules), code_version()])
+        func = stage_cache.cached_chunk
+        args = (cache.cache_dir, version, clean_chunk)
+
+    with osm_io.open_output(new_osm_file) as output:
         output.write(bytes('<?xml version="1.0" encoding="UTF-8"?>\n', 'utf-8'))
         output.write(bytes('<osm>\n', 'utf-8'))
 
-        context = ET.iterparse(osm_file, events=('start', 'end'))
+        if processes > 1:
+            for data, records, counts in osm_chunks.map_chunks(func,
+                    osm_file, processes,
+                    *(args + (log.sink.keeps_records, rules))):
+                output.write(data)
+                log.merge(records, counts)
+        else:
+            with osm_io.open_input(osm_file) as f:
+                context = ET.iterparse(f, events=('start', 'end'))
 
-        _, root = next(context)
+                _, root = next(context)
 
-        # process level-one tags one by one, clean it up after done
-        for event, element in context:
-            if event == 'end' and element.tag in LEVEL_ONE_TAGS:
-                process_element(element)
+                # process level-one tags one by one, clean it up after done
+                for event, element in context:
+                    if event == 'end' and element.tag in LEVEL_ONE_TAGS:
+                        process_element(element, log, rules)
 
-                output.write(ET.tostring(element, encoding='utf-8'))
-                root.clear()
+                        output.write(serialize_element(element))
+                        root.clear()
 
         output.write(bytes('</osm>', 'utf-8'))
 
+    if print_log is not None:
+        print_log.close()
+    elif log is not None:
+        log.flush()
+    if cache is not None:
+        cache.evict()
+
+
+def code_version():
+    """Version of the cleaning code, see stage_cache.code_version."""
+    return stage_cache.code_version(sys.modules[__name__], clean_utils,
+                                    special_cases,
+                                    *stage_cache.reader_modules())
+
 if __name__ == '__main__':
-    import sys
-    clean_osm(sys.argv[1], sys.argv[2])
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Clean an osm file.")
+    parser.add_argument("osm_file")
+    parser.add_argument("new_osm_file")
+    parser.add_argument("processes", type=int, nargs="?", default=1)
+    parser.add_argument("--changes", metavar="FILE",
+            help="write tag changes to FILE (.csv or json lines)")
+    parser.add_argument("--quiet", action="store_true",
+            help="only count tag changes")
+    parser.add_argument("--rules", metavar="FILE",
+            help="special case rules file (default: built-in rules)")
+    parser.add_argument("--cache", metavar="DIR",
+            help="reuse the outputs of a previous run on the same input, "
+                 "rules and options cached in DIR (see stage_cache.py)")
+    parser.add_argument("--cache-mb", type=float,
+            default=stage_cache.MAX_BYTES / 1024 / 1024,
+            help="size limit of the cache (default: %(default).0f)")
+    args = parser.parse_args()
+    if args.quiet and args.changes is not None:
+        parser.error("--quiet and --changes can't be used together")
+
+    rules = None
+    if args.rules is not None:
+        rules = special_cases.SpecialCaseRules.load(args.rules)
+
+    cache = None
+    if args.cache is not None:
+        cache = stage_cache.StageCache(args.cache,
+                                       int(args.cache_mb * 1024 * 1024))
+
+    def run():
+        if args.changes is None and not args.quiet:
+            clean_osm(args.osm_file, args.new_osm_file, args.processes,
+                      rules=rules, cache=cache)
+            return None
+        with change_log.ChangeLog(change_log.open_sink(args.changes)) as log:
+            clean_osm(args.osm_file, args.new_osm_file, args.processes, log,
+                      rules, cache)
+        return log.counts
+
+    if cache is None:
+        counts = run()
+    else:
+        changes_format = args.changes
+        outputs = [args.new_osm_file]
+        if args.changes not in (None, "-"):
+            changes_format = os.path.splitext(args.changes)[1]
+            outputs.append(args.changes)
+        key = stage_cache.make_key("clean_osm", [args.osm_file],
+                {"changes": changes_format, "quiet": args.quiet,
+                 "output": os.path.splitext(args.new_osm_file)[1]},
+                [stage_cache.rules_version(rules), code_version()])
+        counts, hit = cache.run(key, run, outputs)
+        if hit:
+            print("reused cached outputs", file=sys.stderr)
+
+    for rule, count in sorted((counts or {}).items()):
+        print("{}: {}".format(rule, count), file=sys.stderr)
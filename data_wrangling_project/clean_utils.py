@@ -11,14 +11,20 @@ Define methods/regular expressions used to clean osm data
 
 
 import xml.etree.cElementTree as ET
+import functools
 import re
 
+import special_cases
+
 # level-one tags need to be processed
 TAGS_TO_PROCESS = ["node", "way"]
 
 # defines how to clean the "tag" data for some special cases
-# key -- ("k" value, "v" value) of a "tag" element in original osm file
+# key -- ("k" value, "v" value, element id or None) of a "tag" element in
+#        original osm file
 # value -- a list of ("k" value, "v" value) to be added as "tag" element
+# A key written twice here silently keeps the last value only, larger rule
+# sets should go to a rule file loaded with special_cases.py.
 special_case_mapping = {
         ("addr:street", "5223 alpha road dallas tx 75240", None) : [
             ("addr:street", "Alpha Road"),
@@ -89,13 +95,16 @@ special_case_mapping = {
         ("addr:street", "Hwy N 287", None)              :  [("addr:street", "Highway 287 North")],
         ("addr:postcode", "Denton, TX", None)           :  [("addr:postcode", "76210")],
         ("addr:postcode", "74137", None)                :  [("addr:postcode", "75137")],
-        ("addr:postcode", "TX", "2387624602")           :  [("addr:postcode", "75226")],
         ("addr:postcode", "TX", "2387624602")           :  [("addr:postcode", "75044")],
         ("addr:postcode", "TX", "230238099")            :  [("addr:postcode", "75226")],
         ("addr:postcode", "TX", "273516914")            :  [("addr:postcode", "75034")],
         ("addr:postcode", "Texas", "270679006")         :  [("addr:postcode", "76109")],
     }
 
+# special_case_mapping indexed by element id, "k" and "v"
+SPECIAL_CASE_RULES = special_cases.SpecialCaseRules.from_mapping(
+        special_case_mapping)
+
 # street types appear in street name and needs to be fixed
 TYPE_RE = re.compile(r'''
         \b(?:                               # using a non-matching group
@@ -173,52 +182,115 @@ NUMBERED_ROAD_RE = {
 POSTCODE_RE = re.compile(r"\d{5}(?:-\d{4})?")
 
 
-def process_special_cases(element):
+def combine_regex(regex_dict):
+    """Combine the regex objects in regex_dict into a single alternation.
+    Each regex becomes a named group of the alternation, so the key of the
+    regex that matched is keys[m.lastindex].
+
+    :regex_dict: a dict with regex objects as values, all with the same flags
+    :returns: (combined regex object, dict of group index to key)
+
+    """
+    flags = {regex.flags for regex in regex_dict.values()}
+    if len(flags) != 1:
+        raise ValueError("Cannot combine regex objects with different flags")
+
+    names = {"g{}".format(i): key for i, key in enumerate(regex_dict)}
+    pattern = "|".join("(?P<{}>{})".format(name, regex_dict[key].pattern)
+                       for name, key in names.items())
+    regex = re.compile(pattern, flags.pop())
+    return regex, {regex.groupindex[name]: key for name, key in names.items()}
+
+# all directions in a single regex, see normalize_street_name
+DIRECTION_ALL_RE, DIRECTION_KEYS = combine_regex(DIRECTION_RE)
+
+# street names with these words are left alone by update_direction
+DIRECTION_EXCEPTIONS = ["Avenue N", "John W. Elliott", "John W Carpenter"]
+
+# all numbered roads except interstates in a single regex; interstates are
+# handled separately since they are not a plain substitution
+NUMBERED_ROAD_ALL_RE, NUMBERED_ROAD_KEYS = combine_regex(
+        {key: regex for key, regex in NUMBERED_ROAD_RE.items() if key != "I"})
+
+# max number of street names remembered by normalize_street_name
+STREET_NAME_CACHE_SIZE = 100000
+
+
+def process_special_cases(element, log=None, rules=None):
     """Clean children "tag" of the specified element.
     Assuming tags have only attributes "k" and "v". After cleaning, other
     attributes defined in the original tag will be lost, if there is any.
 
     :element: xml.etree.ElementTree.Element object for level-one tags
+    :log: change_log.ChangeLog recording the changes; if None, changes are
+          printed to screen
+    :rules: special_cases.SpecialCaseRules object, SPECIAL_CASE_RULES if None
 
     """
+    if rules is None:
+        rules = SPECIAL_CASE_RULES
+
+    # some cases depend on element id
+    id_rules = rules.rules_for(element.attrib["id"])
+
     subelems = []
-    for tag in element.iter("tag"):
-        key = (tag.attrib["k"], tag.attrib["v"], None)
-        # some cases depend on element id
-        if key not in special_case_mapping:
-            key = (tag.attrib["k"], tag.attrib["v"], element.attrib["id"])
-            if key not in special_case_mapping:
-                continue
+    # iterate over a copy, removing a tag while iterating skips the next one
+    for tag in list(element.iter("tag")):
+        k, v = tag.attrib["k"], tag.attrib["v"]
+        new_tags = rules.lookup(k, v, id_rules)
+        if new_tags is None:
+            continue
 
         element.remove(tag)
 
-        for k, v in special_case_mapping[key]:
-            subelems.append(ET.Element("tag", {"k" : k, "v" : v}))
-            display_tag_change(element, key, (k, v))
+        for new_k, new_v in new_tags:
+            subelems.append(ET.Element("tag", {"k" : new_k, "v" : new_v}))
+            record_change(log, element, (k, v), (new_k, new_v),
+                    "special_case")
 
     element.extend(subelems)
 
-def process_address(element):
+def process_address(element, log=None):
     """Clean address info stored in the children of the specified element.
 
     :element: xml.etree.ElementTree.Element object for level-one tags
+    :log: change_log.ChangeLog recording the changes; if None, changes are
+          printed to screen
 
     """
     for tag in element.iter("tag"):
         key, value = tag.attrib["k"], tag.attrib["v"]
         old_value = value
         if key == "addr:street":
-            value = update_type(value, TYPE_RE, TYPE_MAPPING)
-            value = update_direction(value, DIRECTION_RE)
-            value = update_suite(value, SUITE_RE)
-            value = update_street_name_with_number(value,
-                    NUMBERED_ROAD_RE)
+            value = normalize_street_name(value)
+            rule = "street_name"
         elif key == "addr:postcode":
-            value = update_postcode(value, POSTCODE_RE)
+            on_error = None
+            if log is not None:
+                on_error = lambda postcode: log.record(element,
+                        (key, postcode), (key, postcode), "invalid_postcode")
+            value = update_postcode(value, POSTCODE_RE, on_error)
+            rule = "postcode"
 
         if value != old_value:
             tag.attrib["v"] = value
-            display_tag_change(element, (key, old_value), (key, value))
+            record_change(log, element, (key, old_value), (key, value), rule)
+
+
+def record_change(log, element, old, new, rule):
+    """Record a tag change in log, or print it if log is None.
+
+    :log: change_log.ChangeLog object or None
+    :element: level-one element owning the tag
+    :old: (k, v) pair for old element
+    :new: (k, v) pair for new element
+    :rule: name of the rule that made the change
+
+    """
+    if log is None:
+        display_tag_change(element, old, new)
+    else:
+        log.record(element, old, new, rule)
 
 
 def display_tag_change(element, old, new):
@@ -315,20 +387,161 @@ def update_street_name_with_number(name, numbered_road_re):
             name = regex.sub(key, name)
     return name
 
-def update_postcode(postcode, postcode_re):
+# compiled patterns used by update_type_compiled, keyed by street type
+_type_sub_re = {}
+
+def update_type_compiled(name):
+    """Same as update_type(name, TYPE_RE, TYPE_MAPPING), but the
+    substitution pattern of each street type is only compiled once.
+    """
+    m = TYPE_RE.findall(name)
+    if m:
+        street_type = m[-1]
+        street_type_key = street_type.lower()
+        if street_type_key in TYPE_MAPPING:
+            regex = _type_sub_re.get(street_type)
+            if regex is None:
+                regex = re.compile(r"\b{}(?=\s|$)".format(street_type))
+                _type_sub_re[street_type] = regex
+            name = regex.sub(TYPE_MAPPING[street_type_key], name)
+
+    return name
+
+def _replace_direction(m):
+    return DIRECTION_KEYS[m.lastindex]
+
+def _replace_numbered_road(m):
+    return NUMBERED_ROAD_KEYS[m.lastindex]
+
+@functools.lru_cache(maxsize=STREET_NAME_CACHE_SIZE)
+def normalize_street_name(name):
+    """Clean a street name, giving the same result as
+        update_type(name, TYPE_RE, TYPE_MAPPING)
+        update_direction(name, DIRECTION_RE)
+        update_suite(name, SUITE_RE)
+        update_street_name_with_number(name, NUMBERED_ROAD_RE)
+    applied one after another.
+
+    The direction and numbered road regex are combined into one alternation
+    each, so the name is scanned once per step instead of once per regex,
+    and results are cached since the same street names repeat many times.
+    The rules are read when this module is imported; call
+    normalize_street_name.cache_clear() after changing them.
+
+    :name: street name
+    :returns: cleaned street name
+
+    """
+    name = update_type_compiled(name)
+
+    if not any(word in name for word in DIRECTION_EXCEPTIONS):
+        directed = DIRECTION_ALL_RE.sub(_replace_direction, name)
+        # update_direction applies its regex one after another. When a
+        # replacement drops a dot, it can create a match for a later regex
+        # ("N.West" => "NorthWest" => "Northwest"); a replacement can also
+        # create an exception stopping the remaining regex. These names are
+        # rare, let update_direction handle them.
+        if (("." in name and
+                DIRECTION_ALL_RE.sub(_replace_direction, directed) != directed)
+                or any(word in directed for word in DIRECTION_EXCEPTIONS)):
+            directed = update_direction(name, DIRECTION_RE)
+        name = directed
+
+    name = SUITE_RE.sub(" Suite", name)
+
+    name = NUMBERED_ROAD_ALL_RE.sub(_replace_numbered_road, name)
+    m = NUMBERED_ROAD_RE["I"].search(name)
+    if m:
+        prefix, number = m.groups()
+        name = name.replace(prefix, "I")
+
+    return name
+
+def update_postcode(postcode, postcode_re, on_error=None):
     """Replace postcode by the substring that matches postcode_re
     If postcode does not match postcode_re, an message is printed to screen
     and the original postcode is returned
 
     :postcode: postcode
     :postcode_re: regex object to find real postcode
+    :on_error: if given, called with the postcode instead of printing the
+               message when there is no match
     :returns: converted postcode or the original postcode if there is no match
 
     """
     m = postcode_re.search(postcode)
     if m:
         postdoce = m.group()
+    elif on_error is not None:
+        on_error(postcode)
     else:
         print("Postcode {} is not correct.".format(postcode))
     return postcode
 
+
+def normalize_array(values, normalize):
+    """Apply normalize to every string in values, calling it only once per
+    distinct string. Values are deduplicated with pandas.factorize, the
+    distinct strings are normalized and the results are scattered back
+    with the codes, which is much faster than a row by row apply when
+    values repeat a lot.
+
+    Requires numpy and pandas.
+
+    :values: a sequence, numpy array or pandas.Series of strings;
+             values that are not strings (None, NaN) are left unchanged
+    :normalize: function taking and returning a string
+    :returns: a numpy object array, or a pandas.Series with the same index
+              and name if values is a Series
+
+    """
+    import numpy as np
+    import pandas as pd
+
+    data = np.asarray(values, dtype=object)
+    flat = data.ravel()
+    # missing values get the code -1
+    codes, uniques = pd.factorize(flat)
+
+    normalized = np.empty(len(uniques) + 1, dtype=object)
+    normalized[:-1] = [normalize(v) if isinstance(v, str) else v
+                       for v in uniques.tolist()]
+    result = normalized[codes]
+    missing = codes < 0
+    if missing.any():
+        result[missing] = flat[missing]
+    result = result.reshape(data.shape)
+
+    if isinstance(values, pd.Series):
+        return pd.Series(result, index=values.index, name=values.name)
+    return result
+
+def normalize_street_names(values):
+    """Batch version of normalize_street_name, see normalize_array."""
+    return normalize_array(values, normalize_street_name)
+
+def normalize_postcodes(values, on_error=None):
+    """Batch cleaning of postcodes, see normalize_array: each postcode is
+    replaced by its substring matching POSTCODE_RE, "Grand Prairie, TX
+    75052-8514" => "75052-8514". Postcodes without a match are left
+    unchanged.
+
+    Unlike update_postcode, which returns its input unchanged (the match
+    is assigned to a misspelled variable, "postdoce"), the matched
+    postcode is returned. clean_osm.py keeps the update_postcode behavior.
+
+    :values: same as in normalize_array
+    :on_error: if given, called once with each distinct postcode without
+               a match; nothing is printed
+    :returns: same as normalize_array
+
+    """
+    def normalize(postcode):
+        m = POSTCODE_RE.search(postcode)
+        if m:
+            return m.group()
+        if on_error is not None:
+            on_error(postcode)
+        return postcode
+
+    return normalize_array(values, normalize)
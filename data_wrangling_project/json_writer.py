@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: json_writer.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Buffered writer of the dictionaries produced by osm_to_json.shape_element.
+
+Elements are serialized one by one and collected in a buffer which is
+written to the output file in large blocks. Two formats are supported:
+    - compact: one json object per line without extra spaces (newline
+      delimited json); orjson is used if it is installed, json otherwise
+    - pretty: json.dumps(el, indent=2) followed by a new line
+
+Both compact serializers write non-ASCII characters as raw utf-8. They
+still differ for floats: orjson writes exponents without a "+" (1e16
+instead of 1e+16) and NaN or infinity as null. Outputs cached by
+stage_cache.py are kept apart by serializer_name.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# bytes collected before writing to the file
+BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def _dumps_compact_json(el):
+    return json.dumps(el, separators=(",", ":"),
+                      ensure_ascii=False).encode("utf-8") + b"\n"
+
+def _dumps_compact_orjson(el):
+    return orjson.dumps(el) + b"\n"
+
+def _dumps_pretty(el):
+    return json.dumps(el, indent=2).encode("utf-8") + b"\n"
+
+
+def get_dumps(pretty=False, fast=True):
+    """Get the function serializing an element to a line of utf-8 json.
+
+    :pretty: indented output if True, compact output otherwise
+    :fast: use orjson for compact output if it is installed
+    :returns: a function taking a dictionary and returning bytes
+
+    """
+    if pretty:
+        return _dumps_pretty
+    elif fast and orjson is not None:
+        return _dumps_compact_orjson
+    else:
+        return _dumps_compact_json
+
+
+def serializer_name(pretty=False, fast=True):
+    """Name of the library used by get_dumps, "orjson" or "json"."""
+    return "orjson" if get_dumps(pretty, fast) is _dumps_compact_orjson \
+        else "json"
+
+
+class JsonWriter(object):
+    """Write elements to a binary file through a buffer."""
+
+    def __init__(self, fo, pretty=False, fast=True, buffer_size=BUFFER_SIZE):
+        """
+        :fo: file object opened in binary mode
+        :pretty, fast: see get_dumps
+        :buffer_size: bytes collected before writing to fo
+        """
+        self.fo = fo
+        self.dumps = get_dumps(pretty, fast)
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def write(self, el):
+        """Serialize el and add it to the buffer."""
+        data = self.dumps(el)
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def write_raw(self, data):
+        """Add already serialized bytes to the buffer."""
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffer to the file."""
+        if self.parts:
+            self.fo.write(b"".join(self.parts))
+            self.parts = []
+            self.size = 0
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: node_store.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+On-disk store of node coordinates sorted by node id, used to resolve the
+geometry of ways without holding all nodes in memory.
+
+The store is a directory with two .npy files read as memory maps:
+    - ids.npy: sorted node ids, int64
+    - coords.npy: (lat, lon) of each node in fixed point, int32 in units
+      of 1e-7 degree (the precision of osm files)
+A batch of node references is looked up with a vectorized binary search
+in the ids, so only the pages holding the searched ids are read.
+
+The store is built in one pass over the file. Nodes are collected in runs
+of run_size nodes, each run is sorted and saved; the runs are then copied
+one after another into the store if they are already in order (osm files
+are usually sorted by id), or merged with a k-way merge otherwise. Memory
+use is bounded by run_size either way.
+
+way_geometry turns the node references of a way into its coordinates,
+length and bounding box; osm_to_json.py uses it to add a "geometry" to
+ways (--geometry option).
+
+Usage:
+    python node_store.py dallas.osm dallas_nodes
+"""
+from array import array
+import heapq
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import osm_parser
+
+# nodes sorted in memory at once while building a store
+RUN_SIZE = 8 * 1024 * 1024
+
+# nodes read at once from each run while merging
+MERGE_BLOCK_SIZE = 64 * 1024
+
+# fixed point scale of the coordinates
+SCALE = 10 ** 7
+
+# mean earth radius in meters
+EARTH_RADIUS = 6371008.8
+
+RUN_DTYPE = np.dtype([("id", "<i8"), ("lat", "<i4"), ("lon", "<i4")])
+
+
+class NodeStore(object):
+    """Read-only node coordinates sorted by id, see the module description."""
+
+    def __init__(self, store_dir):
+        """
+        :store_dir: directory written by build
+        """
+        self.store_dir = store_dir
+        self.ids = np.load(os.path.join(store_dir, "ids.npy"), mmap_mode="r")
+        self.coords = np.load(os.path.join(store_dir, "coords.npy"),
+                              mmap_mode="r")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, refs):
+        """Coordinates of the nodes with ids refs.
+
+        :refs: array-like of node ids
+        :returns: (lat, lon, found) numpy arrays, lat and lon being NaN
+                  where found is False
+
+        """
+        refs = np.asarray(refs, dtype=np.int64)
+        positions = np.searchsorted(self.ids, refs)
+        positions = np.minimum(positions, max(len(self.ids) - 1, 0))
+        if len(self.ids):
+            found = self.ids[positions] == refs
+        else:
+            found = np.zeros(len(refs), dtype=bool)
+
+        coords = np.full((len(refs), 2), np.nan)
+        coords[found] = self.coords[positions[found]] / SCALE
+        return coords[:, 0], coords[:, 1], found
+
+
+def build(osm_file, store_dir, run_size=RUN_SIZE):
+    """Build the node store of osm_file.
+
+    :osm_file: osm file name, possibly compressed (see osm_io.py)
+    :store_dir: directory of the store, created if needed
+    :run_size: nodes sorted in memory at once
+    :returns: a NodeStore object
+
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    run_dir = tempfile.mkdtemp(dir=store_dir)
+    try:
+        runs = _write_runs(osm_file, run_dir, run_size)
+        _merge_runs(runs, store_dir)
+    finally:
+        shutil.rmtree(run_dir)
+    return NodeStore(store_dir)
+
+
+def _write_runs(osm_file, run_dir, run_size):
+    """Write the nodes of osm_file in sorted runs.
+
+    :returns: the file names of the runs, in file order
+    """
+    runs = []
+    ids, lats, lons = array("q"), array("i"), array("i")
+
+    def write_run():
+        run = np.empty(len(ids), dtype=RUN_DTYPE)
+        run["id"] = np.frombuffer(ids, dtype=np.int64)
+        run["lat"] = np.frombuffer(lats, dtype=np.int32)
+        run["lon"] = np.frombuffer(lons, dtype=np.int32)
+        run.sort(order="id", kind="stable")
+        run_file = os.path.join(run_dir, "run-{:05d}.npy".format(len(runs)))
+        np.save(run_file, run)
+        runs.append(run_file)
+        del ids[:], lats[:], lons[:]
+
+    for node in osm_parser.parse(osm_file, ["node"], "compact"):
+        if node.lat is None or node.lon is None:
+            continue
+        ids.append(node.id)
+        lats.append(round(node.lat * SCALE))
+        lons.append(round(node.lon * SCALE))
+        if len(ids) >= run_size:
+            write_run()
+
+    if ids or not runs:
+        write_run()
+    return runs
+
+
+def _iter_run(run_file):
+    """Yield the (id, lat, lon) rows of a run, reading it block by block."""
+    run = np.load(run_file, mmap_mode="r")
+    for start in range(0, len(run), MERGE_BLOCK_SIZE):
+        yield from run[start:start + MERGE_BLOCK_SIZE].tolist()
+
+
+def _merge_runs(runs, store_dir):
+    """Write the rows of the sorted runs to the store, sorted by id."""
+    loaded = [np.load(run_file, mmap_mode="r") for run_file in runs]
+    total = sum(len(run) for run in loaded)
+
+    ids = np.lib.format.open_memmap(os.path.join(store_dir, "ids.npy"),
+                                    mode="w+", dtype=np.int64, shape=(total,))
+    coords = np.lib.format.open_memmap(os.path.join(store_dir, "coords.npy"),
+                                       mode="w+", dtype=np.int32,
+                                       shape=(total, 2))
+
+    in_order = all(len(a) == 0 or len(b) == 0 or a["id"][-1] <= b["id"][0]
+                   for a, b in zip(loaded, loaded[1:]))
+    pos = 0
+    if in_order:
+        for run in loaded:
+            for start in range(0, len(run), MERGE_BLOCK_SIZE):
+                block = run[start:start + MERGE_BLOCK_SIZE]
+                end = pos + len(block)
+                ids[pos:end] = block["id"]
+                coords[pos:end, 0] = block["lat"]
+                coords[pos:end, 1] = block["lon"]
+                pos = end
+    else:
+        block = []
+        merged = heapq.merge(*[_iter_run(run_file) for run_file in runs])
+        for row in merged:
+            block.append(row)
+            if len(block) >= MERGE_BLOCK_SIZE:
+                pos = _write_block(ids, coords, pos, block)
+                block = []
+        pos = _write_block(ids, coords, pos, block)
+
+    ids.flush()
+    coords.flush()
+    del ids, coords, loaded
+
+
+def _write_block(ids, coords, pos, block):
+    if not block:
+        return pos
+    rows = np.array(block, dtype=np.int64)
+    end = pos + len(rows)
+    ids[pos:end] = rows[:, 0]
+    coords[pos:end] = rows[:, 1:]
+    return end
+
+
+def is_stale(osm_file, store_dir):
+    """True if the store of osm_file does not exist or is older than it."""
+    ids_file = os.path.join(store_dir, "ids.npy")
+    return (not os.path.exists(ids_file) or
+            os.path.getmtime(ids_file) < os.path.getmtime(osm_file))
+
+
+def load_or_build(osm_file, store_dir, run_size=RUN_SIZE):
+    """Open the node store of osm_file, building it if it is stale."""
+    if is_stale(osm_file, store_dir):
+        return build(osm_file, store_dir, run_size)
+    return NodeStore(store_dir)
+
+
+def way_geometry(store, refs):
+    """Geometry of a way.
+
+    :store: NodeStore object
+    :refs: node ids of the way, in order
+    :returns: a dictionary with
+                - "coordinates": list of [lat, lon] of the nodes found
+                - "length": length in meters along the nodes found
+                - "bbox": [min lat, min lon, max lat, max lon], None if no
+                  node is found
+                - "missing": number of nodes not found in the store
+
+    """
+    lat, lon, found = store.lookup(refs)
+    lat, lon = lat[found], lon[found]
+
+    length = 0.0
+    if len(lat) > 1:
+        rlat, rlon = np.radians(lat), np.radians(lon)
+        a = (np.sin(np.diff(rlat) / 2) ** 2 + np.cos(rlat[:-1]) *
+             np.cos(rlat[1:]) * np.sin(np.diff(rlon) / 2) ** 2)
+        length = float(np.sum(2 * EARTH_RADIUS *
+                              np.arcsin(np.sqrt(np.minimum(a, 1.0)))))
+
+    bbox = None
+    if len(lat):
+        bbox = [float(lat.min()), float(lon.min()),
+                float(lat.max()), float(lon.max())]
+
+    return {"coordinates": np.column_stack((lat, lon)).tolist(),
+            "length": length,
+            "bbox": bbox,
+            "missing": int(len(found) - found.sum())}
+
+
+if __name__ == "__main__":
+    import sys
+    store = build(sys.argv[1], sys.argv[2])
+    print("{} nodes".format(len(store)))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: osc_update.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Update a cleaned osm file with an osmChange (.osc) file, cleaning only the
+elements touched by the change instead of the whole original file:
+
+<osmChange version="0.6">
+  <create> <node id="..." .../> </create>
+  <modify> <way id="..."> ... </way> </modify>
+  <delete> <node id="..." .../> </delete>
+</osmChange>
+
+Created and modified elements are cleaned with clean_osm.process_element
+(special cases and address) and serialized like clean_osm.py does;
+deleted elements are dropped. The new file is written by copying the
+previously cleaned file in large blocks, using its offset index
+(osm_index.py) to find the elements to replace or drop and where to insert
+the created ones, so the file stays sorted by type and id. An element
+changed more than once in the osc file takes its last version; a
+modified element missing from the cleaned file is inserted like a created
+one.
+
+Usage:
+    python osc_update.py dallas_clean.osm changes.osc.gz dallas_clean.osm
+    python osc_update.py dallas_clean.osm changes.osc new.osm --quiet
+"""
+import os
+import tempfile
+import xml.etree.cElementTree as ET
+
+import change_log
+import clean_osm
+import osm_chunks
+import osm_index
+import osm_io
+import special_cases
+
+ACTIONS = ["create", "modify", "delete"]
+
+COPY_SIZE = 4 * 1024 * 1024
+
+
+def read_changes(osc_file, log=None, rules=None):
+    """Clean the created and modified elements of an osc file.
+
+    :osc_file: osc file name, possibly compressed (see osm_io.py)
+    :log, rules: same as in clean_osm.process_element
+    :returns: a dict with (element type, id) as key and the cleaned
+              element serialized by clean_osm.serialize_element as value,
+              None for deleted elements
+
+    """
+    changes = {}
+    with osm_io.open_input(osc_file) as f:
+        context = ET.iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        depth = 1
+        action = None
+
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                if depth == 2:
+                    action = elem
+                continue
+
+            depth -= 1
+            if depth != 2 or elem.tag not in osm_index.ELEMENT_TYPES:
+                if depth == 1:
+                    root.clear()
+                continue
+
+            if action.tag not in ACTIONS:
+                raise ValueError("Unknown osmChange action: {}".format(
+                    action.tag))
+
+            key = (elem.tag, int(elem.attrib["id"]))
+            if action.tag == "delete":
+                changes[key] = None
+            else:
+                clean_osm.process_element(elem, log, rules)
+                changes[key] = clean_osm.serialize_element(elem)
+            action.remove(elem)
+
+    return changes
+
+
+def copy_range(f, output, start, end):
+    """Copy bytes start to end of f to output."""
+    f.seek(start)
+    while start < end:
+        data = f.read(min(COPY_SIZE, end - start))
+        if not data:
+            raise ValueError("Unexpected end of {}".format(f.name))
+        output.write(data)
+        start += len(data)
+
+
+def apply_changes(cleaned_file, changes, new_file):
+    """Write cleaned_file with changes applied to new_file.
+
+    :cleaned_file: uncompressed osm file written by clean_osm.py
+    :changes: dict returned by read_changes
+    :new_file: file to write, may be cleaned_file itself
+    :returns: a dict with the number of "created", "modified" and
+              "deleted" elements
+
+    """
+    index = osm_index.load_or_build(cleaned_file)
+    counts = {"created": 0, "modified": 0, "deleted": 0}
+
+    # (position, is a replacement, key, data): inserts before position
+    # come before the replacement of the element at position
+    events = []
+    for key, data in changes.items():
+        i = index.find(*key)
+        if i is not None:
+            events.append((i, 1, key, data))
+            counts["deleted" if data is None else "modified"] += 1
+        elif data is not None:
+            events.append((index.insertion_point(*key), 0, key, data))
+            counts["created"] += 1
+    events.sort(key=lambda event: (event[0], event[1],
+                                   osm_index.ELEMENT_TYPES.index(event[2][0]),
+                                   event[2][1]))
+
+    out_dir = os.path.dirname(os.path.abspath(new_file))
+    fd, tmp_file = tempfile.mkstemp(dir=out_dir, suffix=".osm.tmp")
+    try:
+        with open(cleaned_file, "rb") as f, os.fdopen(fd, "wb") as output:
+            osm_end = osm_chunks.find_osm_end(f)
+
+            def start_of(i):
+                return index.offsets[i] if i < len(index) else osm_end
+
+            pos = 0
+            for i, is_replacement, _, data in events:
+                start = start_of(i)
+                copy_range(f, output, pos, start)
+                if data is not None:
+                    output.write(data)
+                # a replaced element is skipped with its trailing space
+                pos = start_of(i + 1) if is_replacement else start
+
+            copy_range(f, output, pos, f.seek(0, os.SEEK_END))
+        os.replace(tmp_file, new_file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+    return counts
+
+
+def update(cleaned_file, osc_file, new_file, log=None, rules=None):
+    """Apply an osc file to a cleaned osm file, see the module description.
+
+    :cleaned_file: uncompressed osm file written by clean_osm.py
+    :osc_file: osc file name, possibly compressed
+    :new_file: file to write, may be cleaned_file itself
+    :log: change_log.ChangeLog recording the tag changes; if None, changes
+          are printed to screen. The log is flushed but not closed.
+    :rules: special_cases.SpecialCaseRules object, the built-in rules if None
+    :returns: same as apply_changes
+
+    """
+    changes = read_changes(osc_file, log, rules)
+    counts = apply_changes(cleaned_file, changes, new_file)
+    if log is not None:
+        log.flush()
+    return counts
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+            description="Apply an osmChange file to a cleaned osm file.")
+    parser.add_argument("cleaned_file")
+    parser.add_argument("osc_file")
+    parser.add_argument("new_file")
+    parser.add_argument("--changes", metavar="FILE",
+            help="write tag changes to FILE (.csv or json lines)")
+    parser.add_argument("--quiet", action="store_true",
+            help="only count tag changes")
+    parser.add_argument("--rules", metavar="FILE",
+            help="special case rules file (default: built-in rules)")
+    args = parser.parse_args()
+    if args.quiet and args.changes is not None:
+        parser.error("--quiet and --changes can't be used together")
+
+    rules = None
+    if args.rules is not None:
+        rules = special_cases.SpecialCaseRules.load(args.rules)
+
+    if args.changes is None and not args.quiet:
+        counts = update(args.cleaned_file, args.osc_file, args.new_file,
+                        rules=rules)
+    else:
+        with change_log.ChangeLog(change_log.open_sink(args.changes)) as log:
+            counts = update(args.cleaned_file, args.osc_file, args.new_file,
+                            log, rules)
+        for rule, count in sorted(log.counts.items()):
+            print("{}: {}".format(rule, count), file=sys.stderr)
+
+    for action in ("created", "modified", "deleted"):
+        print("{}: {}".format(action, counts[action]), file=sys.stderr)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: osm_chunks.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Split an osm file into byte ranges at top-level element boundaries and
+process the ranges in parallel.
+
+A range always starts at the "<" of a top-level "node", "way", "relation"
+or "bounds" element and ends where the next range starts (the last range
+ends at "</osm>"), so every top-level element, together with the white
+space following it, belongs to exactly one range. Each range is parsed on
+its own by wrapping it into an "<osm>" root element, which lets clean_osm.py
+and osm_to_json.py reuse their per-element functions in worker processes and
+write the results back in file order.
+"""
+import bisect
+import io
+import multiprocessing
+import os
+import re
+
+import osm_parser
+
+# start of a top-level element
+ELEMENT_START_RE = re.compile(rb"<(?:node|way|relation|bounds)[\s/>]")
+
+# longest possible match of ELEMENT_START_RE, used to overlap reads
+ELEMENT_START_LEN = len(b"<relation ")
+
+# target size of a range, keeps the memory used by a worker bounded
+CHUNK_SIZE = 64 * 1024 * 1024
+
+READ_SIZE = 1024 * 1024
+
+
+def find_element_start(f, pos):
+    """Find the first top-level element starting at or after pos.
+
+    :f: osm file opened in binary mode
+    :pos: byte offset to start searching from
+    :returns: byte offset of the element or None if there is none
+
+    """
+    f.seek(pos)
+    while True:
+        block = f.read(READ_SIZE)
+        if not block:
+            return None
+
+        m = ELEMENT_START_RE.search(block)
+        if m:
+            return pos + m.start()
+
+        if len(block) < READ_SIZE:
+            return None
+
+        # step back so a start tag split between two reads is not missed
+        pos += len(block) - ELEMENT_START_LEN
+        f.seek(pos)
+
+
+def find_osm_end(f):
+    """Find the closing "</osm>" tag.
+
+    :f: osm file opened in binary mode
+    :returns: byte offset of "</osm>"
+
+    """
+    size = f.seek(0, os.SEEK_END)
+    pos = size
+    while pos > 0:
+        pos = max(0, pos - READ_SIZE)
+        f.seek(pos)
+        block = f.read(READ_SIZE + len(b"</osm>"))
+        i = block.rfind(b"</osm>")
+        if i >= 0:
+            return pos + i
+    raise ValueError("No </osm> tag found in {}".format(f.name))
+
+
+def find_chunks(osm_file, n_chunks, index=None):
+    """Split osm_file into at most n_chunks byte ranges of similar size.
+
+    :osm_file: name of an uncompressed osm file
+    :n_chunks: number of ranges wanted
+    :index: optional osm_index.OsmIndex of osm_file; if given, range starts
+            are taken from it instead of searching the file
+    :returns: a list of (start, end) byte offsets in file order
+
+    """
+    with open(osm_file, "rb") as f:
+        end = find_osm_end(f)
+        first = find_element_start(f, 0)
+        if first is None or first >= end:
+            return []
+
+        offsets = [first]
+        for i in range(1, n_chunks):
+            approx = first + (end - first) * i // n_chunks
+            if index is not None:
+                j = bisect.bisect_left(index.offsets, approx)
+                pos = index.offsets[j] if j < len(index) else None
+            else:
+                pos = find_element_start(f, max(approx, offsets[-1] + 1))
+            if pos is None or pos >= end:
+                break
+            if pos > offsets[-1]:
+                offsets.append(pos)
+        offsets.append(end)
+
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def read_chunk(osm_file, start, end):
+    """Read the bytes in [start, end) of osm_file."""
+    with open(osm_file, "rb") as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def iter_chunk_elements(osm_file, start, end, tags, backend="etree"):
+    """Yield the top-level elements of a byte range whose tag is in tags.
+    The tree is cleared after each yielded element, like the serial
+    iterparse loops do.
+
+    :osm_file: name of an uncompressed osm file
+    :start, end: byte range returned by find_chunks
+    :tags: top-level tags to yield
+    :backend: parser backend, "etree" or "expat" (see osm_parser.py)
+    """
+    data = b"<osm>" + read_chunk(osm_file, start, end) + b"</osm>"
+    return osm_parser.parse(io.BytesIO(data), tags, backend)
+
+
+def default_chunk_count(osm_file, processes):
+    """Number of ranges to use: a few per process for load balancing, and
+    enough to keep each range around CHUNK_SIZE bytes.
+    """
+    return max(processes * 4, os.path.getsize(osm_file) // CHUNK_SIZE + 1)
+
+
+def map_chunks(func, osm_file, processes, *args, index=None):
+    """Call func(osm_file, start, end, *args) on every range of osm_file in a
+    pool of processes.
+
+    :func: a module level function (it is pickled to the workers)
+    :osm_file: name of an uncompressed osm file
+    :processes: number of worker processes
+    :index: optional osm_index.OsmIndex of osm_file, see find_chunks
+    :returns: an iterator over the results, in file order
+
+    """
+    chunks = find_chunks(osm_file, default_chunk_count(osm_file, processes),
+                         index)
+    tasks = [(func, osm_file, start, end) + args for start, end in chunks]
+
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.imap(_call, tasks):
+            yield result
+
+
+def _call(task):
+    func, args = task[0], task[1:]
+    return func(*args)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: osm_index.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Build an offset index of the top-level "node", "way" and "relation"
+elements of an osm file.
+
+The file is memory-mapped and scanned with a bytes regex for the start tags
+and a plain search for the end tags, no ElementTree objects are created. For every element the index keeps
+    - element type (0: node, 1: way, 2: relation)
+    - id
+    - byte offset of its "<"
+    - length in bytes, up to and including its end tag
+in four arrays, which are saved to disk as raw little-endian arrays behind
+a small header. The index is used to read single elements at random
+(sample_osm_file.py) and to split the file into ranges (osm_chunks.py).
+
+Usage:
+    python osm_index.py dallas.osm              # writes dallas.osm.idx
+    python osm_index.py dallas.osm index_file
+"""
+from array import array
+import bisect
+import mmap
+import os
+import re
+import struct
+import sys
+
+ELEMENT_TYPES = ["node", "way", "relation"]
+
+TYPE_CODES = {name.encode("ascii"): code
+              for code, name in enumerate(ELEMENT_TYPES)}
+
+# start tag of a top-level element, group 1 is its type and group 2 its id
+START_TAG_RE = re.compile(rb'''
+        <(node|way|relation)        # element type
+        [^>]*?\sid="(-?\d+)"        # id attribute
+        [^>]*>                      # other attributes, end of start tag
+        ''', re.VERBOSE)
+
+SLASH = ord("/")
+
+END_TAGS = {name: b"</" + name + b">" for name in TYPE_CODES}
+
+MAGIC = b"OSMIDX01"
+
+# magic, number of elements
+HEADER = struct.Struct("<8sQ")
+
+
+class OsmIndex(object):
+    """Offsets of the top-level elements of an osm file, in file order."""
+
+    def __init__(self, types=None, ids=None, offsets=None, lengths=None):
+        self.types = types if types is not None else array("B")
+        self.ids = ids if ids is not None else array("q")
+        self.offsets = offsets if offsets is not None else array("q")
+        self.lengths = lengths if lengths is not None else array("I")
+        self._lookup = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, osm_file):
+        """Scan osm_file and index its top-level elements.
+
+        :osm_file: name of an uncompressed osm file
+        :returns: an OsmIndex object
+
+        """
+        index = cls()
+        if os.path.getsize(osm_file) == 0:
+            return index
+
+        types, ids = index.types.append, index.ids.append
+        offsets, lengths = index.offsets.append, index.lengths.append
+        search = START_TAG_RE.search
+        with open(osm_file, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                m = search(mm)
+                while m:
+                    name, element_id = m.groups()
+                    start, end = m.span()
+                    if mm[end - 2] != SLASH:
+                        # children never contain the element's own end tag
+                        end_tag = END_TAGS[name]
+                        end = mm.find(end_tag, end)
+                        if end < 0:
+                            raise ValueError("Unclosed <{}> at byte {}".format(
+                                name.decode("ascii"), start))
+                        end += len(end_tag)
+                    types(TYPE_CODES[name])
+                    ids(int(element_id))
+                    offsets(start)
+                    lengths(end - start)
+                    m = search(mm, end)
+        return index
+
+    def save(self, index_file):
+        """Write the index to index_file."""
+        with open(index_file, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(self)))
+            for values in (self.types, self.ids, self.offsets, self.lengths):
+                if sys.byteorder == "big":
+                    values = array(values.typecode, values)
+                    values.byteswap()
+                values.tofile(f)
+
+    @classmethod
+    def load(cls, index_file):
+        """Read an index written by save.
+
+        :index_file: name of the index file
+        :returns: an OsmIndex object
+
+        """
+        index = cls()
+        with open(index_file, "rb") as f:
+            magic, count = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError("{} is not an osm index file".format(
+                    index_file))
+            for values in (index.types, index.ids, index.offsets,
+                    index.lengths):
+                values.fromfile(f, count)
+                if sys.byteorder == "big":
+                    values.byteswap()
+        return index
+
+    def element_type(self, i):
+        """Type name of the i-th element."""
+        return ELEMENT_TYPES[self.types[i]]
+
+    def find(self, element_type, element_id):
+        """Position in the index of an element, or None if it is not indexed.
+
+        :element_type: "node", "way" or "relation"
+        :element_id: id of the element, int
+        """
+        if self._lookup is None:
+            self._lookup = self._build_lookup()
+
+        code = ELEMENT_TYPES.index(element_type)
+        ids, first = self._lookup[code]
+        if isinstance(ids, dict):
+            return ids.get(element_id)
+
+        # osm files are usually sorted by id within each type
+        i = bisect.bisect_left(ids, element_id)
+        if i < len(ids) and ids[i] == element_id:
+            return first + i
+        return None
+
+    def insertion_point(self, element_type, element_id):
+        """Position before which a new element would be written to keep the
+        file sorted by type ("node", "way", "relation") and id.
+
+        :element_type: "node", "way" or "relation"
+        :element_id: id of the element, int
+        :returns: a position in the index, len(self) for the end of file
+
+        """
+        if self._lookup is None:
+            self._lookup = self._build_lookup()
+
+        code = ELEMENT_TYPES.index(element_type)
+        ids, first = self._lookup[code]
+        if isinstance(ids, dict):
+            # not sorted, after the last element of the type
+            return max(ids.values()) + 1 if ids else len(self)
+        if len(ids):
+            return first + bisect.bisect_left(ids, element_id)
+
+        # no element of this type, before the first one of a later type
+        for later in ELEMENT_TYPES[code + 1:]:
+            positions = self.positions(later)
+            if len(positions):
+                return positions[0]
+        return len(self)
+
+    def positions(self, element_type):
+        """Positions in the index of all elements of element_type.
+
+        :element_type: "node", "way" or "relation"
+        :returns: a range if the elements are stored one after another, which
+                  is the case for usual osm files, a list otherwise
+
+        """
+        code = ELEMENT_TYPES.index(element_type)
+        types = self.types.tobytes()
+        code_byte = bytes([code])
+        count = types.count(code_byte)
+        if not count:
+            return range(0)
+
+        first, last = types.find(code_byte), types.rfind(code_byte)
+        if last - first + 1 == count:
+            return range(first, last + 1)
+        return [i for i in range(first, last + 1) if types[i] == code]
+
+    def _build_lookup(self):
+        """For each type, the sorted ids of its contiguous block of elements
+        and the position of the block, or a dict if the file is not sorted.
+        """
+        lookup = []
+        for element_type in ELEMENT_TYPES:
+            positions = self.positions(element_type)
+            if isinstance(positions, range):
+                ids = self.ids[positions.start:positions.stop]
+                if all(a < b for a, b in zip(ids, ids[1:])):
+                    lookup.append((ids, positions.start))
+                    continue
+            lookup.append(({self.ids[i]: i for i in positions}, 0))
+        return lookup
+
+    def read(self, f, i):
+        """Read the raw bytes of the i-th element.
+
+        :f: the indexed osm file opened in binary mode, or a mmap of it
+        :i: position of the element in the index
+        """
+        f.seek(self.offsets[i])
+        return f.read(self.lengths[i])
+
+
+def index_file_name(osm_file):
+    """Default name of the index of osm_file."""
+    return osm_file + ".idx"
+
+
+def load_or_build(osm_file, index_file=None):
+    """Load the index of osm_file, or build and save it if the index file
+    does not exist or is older than osm_file.
+
+    :osm_file: name of an uncompressed osm file
+    :index_file: name of the index file, osm_file + ".idx" if None
+    :returns: an OsmIndex object
+
+    """
+    if index_file is None:
+        index_file = index_file_name(osm_file)
+
+    if (os.path.exists(index_file) and
+            os.path.getmtime(index_file) >= os.path.getmtime(osm_file)):
+        return OsmIndex.load(index_file)
+
+    index = OsmIndex.build(osm_file)
+    index.save(index_file)
+    return index
+
+
+if __name__ == "__main__":
+    osm_file = sys.argv[1]
+    index_file = sys.argv[2] if len(sys.argv) > 2 else index_file_name(osm_file)
+    index = OsmIndex.build(osm_file)
+    index.save(index_file)
+    for code, name in enumerate(ELEMENT_TYPES):
+        print("{}: {}".format(name, index.types.count(code)))
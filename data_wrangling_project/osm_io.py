@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: osm_io.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Open osm input and output files, compressed or not.
+
+Supported compressions are gzip (.gz), bz2 (.bz2), xz (.xz) and zstd (.zst,
+only if the zstandard package is installed). The compression of an input
+file is detected from its extension, or from its first bytes if the
+extension is unknown; the compression of an output file from its extension.
+Data is always decompressed while streaming, nothing is written to disk.
+
+bz2 files made of many concatenated streams (as written by pbzip2 or
+lbzip2) are decompressed in a pool of processes, bz2 being by far the
+slowest of these formats to decompress. A file written by the plain bzip2
+tool has a single stream and is decompressed serially.
+"""
+import bz2
+import collections
+import gzip
+import io
+import lzma
+import multiprocessing
+import os
+import re
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EXTENSIONS = {
+        ".gz"  : "gzip",
+        ".bz2" : "bz2",
+        ".xz"  : "xz",
+        ".zst" : "zstd",
+        }
+
+MAGIC = [
+        (b"\x1f\x8b", "gzip"),
+        (b"BZh", "bz2"),
+        (b"\xfd7zXZ\x00", "xz"),
+        (b"\x28\xb5\x2f\xfd", "zstd"),
+        ]
+
+# start of a bz2 stream: header with block size, then the first block magic
+BZ2_STREAM_RE = re.compile(rb"BZh[1-9]1AY&SY")
+
+# compressed bytes decompressed by a worker at once
+BZ2_BATCH_SIZE = 8 * 1024 * 1024
+
+READ_SIZE = 1024 * 1024
+
+
+def detect_compression(path, use_magic=True):
+    """Compression of path: "gzip", "bz2", "xz", "zstd" or None.
+
+    :path: file name
+    :use_magic: look at the first bytes of the file if the extension is not
+                a known one
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in EXTENSIONS:
+        return EXTENSIONS[ext]
+
+    if use_magic and os.path.exists(path):
+        with open(path, "rb") as f:
+            head = f.read(8)
+        for magic, compression in MAGIC:
+            if head.startswith(magic):
+                return compression
+    return None
+
+
+def is_compressed(path):
+    """True if path is a compressed file."""
+    return detect_compression(path) is not None
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("zstandard is required for .zst files: "
+                          "pip install zstandard")
+
+
+def open_input(path, processes=None):
+    """Open an osm file for reading in binary mode, decompressing it.
+
+    :path: file name
+    :processes: number of processes decompressing a multi-stream bz2 file,
+                os.cpu_count() if None
+    :returns: a binary file object, to be closed by the caller
+
+    """
+    compression = detect_compression(path)
+    if compression is None:
+        return open(path, "rb")
+    elif compression == "gzip":
+        return gzip.open(path, "rb")
+    elif compression == "xz":
+        return lzma.open(path, "rb")
+    elif compression == "zstd":
+        _require_zstandard()
+        f = open(path, "rb")
+        return zstandard.ZstdDecompressor().stream_reader(f, closefd=True)
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    batches = find_bz2_batches(path) if processes > 1 else []
+    if len(batches) < 2:
+        return bz2.open(path, "rb")
+    return io.BufferedReader(IterReader(
+        decompress_bz2_batches(path, batches, processes)), READ_SIZE)
+
+
+def open_output(path):
+    """Open a file for writing in binary mode, compressing the data according
+    to the extension of path.
+
+    :path: file name
+    :returns: a binary file object, to be closed by the caller
+
+    """
+    compression = detect_compression(path, use_magic=False)
+    if compression is None:
+        return open(path, "wb")
+    elif compression == "gzip":
+        return gzip.open(path, "wb", compresslevel=6)
+    elif compression == "bz2":
+        return bz2.open(path, "wb")
+    elif compression == "xz":
+        return lzma.open(path, "wb")
+    else:
+        _require_zstandard()
+        f = open(path, "wb")
+        return zstandard.ZstdCompressor().stream_writer(f, closefd=True)
+
+
+def open_text_output(path):
+    """Same as open_output, for writing utf-8 text."""
+    return io.TextIOWrapper(open_output(path), encoding="utf-8")
+
+
+def find_bz2_batches(path):
+    """Split a bz2 file into byte ranges of whole streams.
+
+    :path: name of a bz2 file
+    :returns: a list of (start, end) byte offsets, each range holding one
+              or more streams and about BZ2_BATCH_SIZE bytes
+
+    """
+    starts = []
+    with open(path, "rb") as f:
+        pos = 0
+        while True:
+            block = f.read(READ_SIZE)
+            if not block:
+                break
+            for m in BZ2_STREAM_RE.finditer(block):
+                if pos + m.start() not in starts[-1:]:
+                    starts.append(pos + m.start())
+            if len(block) < READ_SIZE:
+                break
+            # overlap reads so a stream header is not split
+            pos += len(block) - 9
+            f.seek(pos)
+        size = f.seek(0, os.SEEK_END)
+
+    if not starts or starts[0] != 0:
+        return []
+
+    batches = []
+    batch_start = 0
+    for start in starts[1:]:
+        if start - batch_start >= BZ2_BATCH_SIZE:
+            batches.append((batch_start, start))
+            batch_start = start
+    batches.append((batch_start, size))
+    return batches
+
+
+def _decompress_range(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    try:
+        return bz2.decompress(data)
+    except (OSError, EOFError, ValueError):
+        # a stream header pattern found inside compressed data
+        return None
+
+
+def decompress_bz2_batches(path, batches, processes):
+    """Decompress the ranges of a multi-stream bz2 file in a pool of
+    processes, keeping a bounded number of ranges in flight.
+
+    :path: name of a bz2 file
+    :batches: ranges returned by find_bz2_batches
+    :processes: number of worker processes
+    :returns: an iterator over the decompressed data, in file order
+
+    """
+    with multiprocessing.Pool(processes) as pool:
+        pending = collections.deque()
+        tasks = iter(batches)
+        # byte range that did not decompress, to be joined with the next one
+        failed = None
+
+        for start, end in tasks:
+            pending.append(((start, end),
+                pool.apply_async(_decompress_range, (path, start, end))))
+            if len(pending) >= processes * 2:
+                break
+
+        while pending:
+            (start, end), result = pending.popleft()
+            for next_start, next_end in tasks:
+                pending.append(((next_start, next_end),
+                    pool.apply_async(_decompress_range,
+                        (path, next_start, next_end))))
+                break
+
+            data = result.get()
+            if failed is None and data is not None:
+                yield data
+                continue
+
+            # a range boundary fell inside a stream; join it with the
+            # following ranges until the data decompresses
+            failed = (failed[0], end) if failed is not None else (start, end)
+            data = _decompress_range(path, *failed)
+            if data is not None:
+                failed = None
+                yield data
+
+        if failed is not None:
+            raise OSError("Invalid bz2 data in {}".format(path))
+
+
+class IterReader(io.RawIOBase):
+    """Read-only raw stream over an iterator of bytes."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = memoryview(b"")
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.pos >= len(self.buffer):
+            try:
+                self.buffer = memoryview(next(self.chunks))
+            except StopIteration:
+                return 0
+            self.pos = 0
+        n = min(len(b), len(self.buffer) - self.pos)
+        b[:n] = self.buffer[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def close(self):
+        if hasattr(self.chunks, "close"):
+            self.chunks.close()
+        super().close()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: osm_parser.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Parse osm files with one of three backends:
+    - etree: ET.iterparse, yielding xml.etree.ElementTree.Element objects;
+      every "tag", "nd" and "member" child is an Element of its own
+    - expat: expat callbacks building one OsmRecord per top-level element,
+      without any Element object
+    - compact: same as expat, building the smaller osm_record.OsmElement
+      objects, for stages keeping elements in memory
+
+An OsmRecord has the attributes
+    - tag: "node", "way", "relation", "bounds", or "osm" for the root
+    - attrib: dict of the element attributes
+    - tags: list of (k, v) pairs of the "tag" children
+    - nd_refs: list of the "ref" of the "nd" children
+    - members: list of (type, ref, role) of the "member" children
+Other elements are treated as top-level elements. The root record has no
+children and is yielded last.
+
+tag_pairs, nd_refs and child_counts accept the elements of any backend,
+so shape_element in osm_to_json.py and the audits work on
+either backend. clean_osm.py modifies and writes back the parsed elements,
+so it always uses etree.
+"""
+import xml.etree.cElementTree as ET
+import xml.parsers.expat
+
+import osm_io
+
+BACKENDS = ["etree", "expat", "compact"]
+
+# level-one tags, the etree tree is cleared after each of them is yielded
+LEVEL_ONE_TAGS = ["node", "way", "relation", "bounds"]
+
+READ_SIZE = 64 * 1024
+
+
+class OsmRecord(object):
+    """Top-level osm element and its "tag", "nd" and "member" children."""
+
+    __slots__ = ("tag", "attrib", "tags", "nd_refs", "members")
+
+    def __init__(self, tag, attrib):
+        self.tag = tag
+        self.attrib = attrib
+        self.tags = []
+        self.nd_refs = []
+        self.members = []
+
+    def __repr__(self):
+        return "<OsmRecord {} {}>".format(self.tag, self.attrib.get("id"))
+
+    def get(self, name, default=None):
+        """Value of attribute name, like Element.get."""
+        return self.attrib.get(name, default)
+
+
+def tag_pairs(element):
+    """(k, v) pairs of the "tag" children of element.
+
+    :element: xml.etree.ElementTree.Element object, OsmRecord or
+              osm_record.OsmElement
+    :returns: a sequence of (k, v) tuples
+
+    """
+    if isinstance(element, ET.Element):
+        return [(tag.attrib["k"], tag.attrib["v"])
+                for tag in element.iter("tag")]
+    return element.tags
+
+
+def nd_refs(element):
+    """"ref" values of the "nd" children of element.
+
+    :element: xml.etree.ElementTree.Element object, OsmRecord or
+              osm_record.OsmElement
+    :returns: a sequence of strings, or of ints for an OsmElement
+
+    """
+    if isinstance(element, ET.Element):
+        return [nd.attrib["ref"] for nd in element.iter("nd")]
+    return element.nd_refs or ()
+
+
+def child_counts(element):
+    """Number of elements visited through element, by tag. An Element
+    counts for itself only, since the etree backend yields its children
+    separately; the records of the other backends also count their
+    children.
+
+    :element: xml.etree.ElementTree.Element object, OsmRecord or
+              osm_record.OsmElement
+    :returns: a list of (tag, count) tuples
+
+    """
+    counts = [(element.tag, 1)]
+    if not isinstance(element, ET.Element):
+        for tag, children in (("tag", element.tags),
+                              ("nd", element.nd_refs),
+                              ("member", element.members)):
+            if children:
+                counts.append((tag, len(children)))
+    return counts
+
+
+def iter_records(osm_file, tags=None):
+    """Yield an OsmRecord for every top-level element of osm_file.
+
+    :osm_file: osm file name (possibly compressed, see osm_io.py) or file
+               object opened in binary mode
+    :tags: tags of the records to yield, all of them (including the root)
+           if None
+    """
+    if isinstance(osm_file, str):
+        with osm_io.open_input(osm_file) as f:
+            yield from iter_records(f, tags)
+        return
+
+    # osm files have a fixed structure: every element but the root is either
+    # a top-level element or a child of one, which is told by its name. A
+    # record is complete when the next top-level element starts, so no end
+    # handler is needed.
+    records = []
+    record = None
+    root = None
+
+    def start(name, attrs):
+        nonlocal record, root
+        if name == "nd":
+            record.nd_refs.append(attrs["ref"])
+        elif name == "tag":
+            record.tags.append((attrs["k"], attrs["v"]))
+        elif name == "member":
+            record.members.append((attrs["type"], attrs["ref"], attrs["role"]))
+        elif root is None:
+            root = OsmRecord(name, attrs)
+        else:
+            if record is not None and (tags is None or record.tag in tags):
+                records.append(record)
+            record = OsmRecord(name, attrs)
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start
+
+    while True:
+        data = osm_file.read(READ_SIZE)
+        parser.Parse(data, not data)
+        if records:
+            yield from records
+            records.clear()
+        if not data:
+            break
+
+    if record is not None and (tags is None or record.tag in tags):
+        yield record
+    if root is not None and (tags is None or root.tag in tags):
+        yield root
+
+
+def iter_elements(osm_file, tags=None):
+    """Yield the elements of osm_file with ET.iterparse, clearing the tree
+    after each top-level element.
+
+    :osm_file: osm file name (possibly compressed, see osm_io.py) or file
+               object opened in binary mode
+    :tags: tags of the elements to yield, all of them (at any depth) if None
+    """
+    if isinstance(osm_file, str):
+        with osm_io.open_input(osm_file) as f:
+            yield from iter_elements(f, tags)
+        return
+
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, element in context:
+        if event != 'end':
+            continue
+        if tags is None or element.tag in tags:
+            yield element
+        if element.tag in LEVEL_ONE_TAGS:
+            root.clear()
+
+
+def parse(osm_file, tags=None, backend="etree"):
+    """Yield the elements of osm_file parsed by backend, see iter_elements,
+    iter_records and osm_record.iter_elements.
+
+    :backend: "etree", "expat" or "compact"
+    :raises ValueError: if backend is unknown
+    """
+    if backend == "etree":
+        return iter_elements(osm_file, tags)
+    elif backend == "expat":
+        return iter_records(osm_file, tags)
+    elif backend == "compact":
+        # imported here since osm_record imports this module
+        import osm_record
+        return osm_record.iter_elements(osm_file, tags)
+    raise ValueError("Unknown parser backend: {}".format(backend))
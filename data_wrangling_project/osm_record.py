@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: osm_record.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Compact in-memory representation of top-level osm elements, used by the
+"compact" backend of osm_parser.py.
+
+An OsmElement stores
+    - id, version, changeset and uid as int, lat and lon as float,
+      timestamp and user as str
+    - tags: tuple of (k, v) pairs, with interned "k" values
+    - nd_refs: array('q') of the node ids of a way, None for other elements
+    - members: tuple of (type, ref, role) of a relation, ref being an int
+    - layout: the names of the attributes in file order; elements with the
+      same attributes share one interned tuple
+    - extra: dict of any other attribute, and of the numbers not written in
+      their canonical form ("32.6980230", "007"), None if there is none
+in __slots__, which makes it several times smaller than an ElementTree
+element with its children, or an osm_parser.OsmRecord.
+
+Elements are converted back to strings only at the output edge:
+attrib rebuilds the attribute dict, with the same strings as in the file,
+and to_record the equivalent OsmRecord, which shape_element turns into the
+json dictionary.
+"""
+from array import array
+import sys
+import xml.parsers.expat
+
+import osm_io
+import osm_parser
+
+INT_ATTRIBUTES = ("id", "version", "changeset", "uid")
+FLOAT_ATTRIBUTES = ("lat", "lon")
+STR_ATTRIBUTES = ("timestamp", "user")
+
+NUMBER_ATTRIBUTES = INT_ATTRIBUTES + FLOAT_ATTRIBUTES
+
+KNOWN_ATTRIBUTES = frozenset(INT_ATTRIBUTES + FLOAT_ATTRIBUTES +
+                             STR_ATTRIBUTES)
+
+# tag values up to this length are interned, most of them repeat a lot
+# ("yes", "residential", postcodes...)
+INTERN_VALUE_LENGTH = 32
+
+# interned attribute layouts, with a flag telling if they have attributes
+# other than KNOWN_ATTRIBUTES
+_LAYOUTS = {}
+
+
+class OsmElement(object):
+    """Compact top-level osm element, see the module description."""
+
+    __slots__ = ("tag", "id", "version", "changeset", "uid", "lat", "lon",
+                 "timestamp", "user", "tags", "nd_refs", "members", "layout",
+                 "extra")
+
+    def __init__(self, tag, attrs):
+        """
+        :tag: element tag, e.g. "node"
+        :attrs: dict of the element attributes, as parsed
+        """
+        self.tag = sys.intern(tag)
+
+        layout = tuple(attrs)
+        if layout not in _LAYOUTS:
+            _LAYOUTS[layout] = (layout,
+                                not KNOWN_ATTRIBUTES.issuperset(layout))
+        self.layout, has_extra = _LAYOUTS[layout]
+
+        get = attrs.get
+        value = get("id")
+        self.id = None if value is None else int(value)
+        value = get("version")
+        self.version = None if value is None else int(value)
+        value = get("changeset")
+        self.changeset = None if value is None else int(value)
+        value = get("uid")
+        self.uid = None if value is None else int(value)
+        value = get("lat")
+        self.lat = None if value is None else float(value)
+        value = get("lon")
+        self.lon = None if value is None else float(value)
+        self.timestamp = get("timestamp")
+        value = get("user")
+        self.user = None if value is None else sys.intern(value)
+
+        self.extra = None
+        if has_extra:
+            self.extra = {sys.intern(name): value
+                          for name, value in attrs.items()
+                          if name not in KNOWN_ATTRIBUTES}
+
+        # numbers keep their string if it can't be rebuilt from the number,
+        # e.g. the trailing zeros of "32.6980230"
+        for name in NUMBER_ATTRIBUTES:
+            value = get(name)
+            if value is not None and _number_str(getattr(self, name)) != value:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[name] = value
+
+        self.tags = ()
+        self.nd_refs = None
+        self.members = ()
+
+    def __repr__(self):
+        return "<OsmElement {} {}>".format(self.tag, self.id)
+
+    def get(self, name, default=None):
+        """String value of attribute name as parsed, like attrib.get(name)."""
+        if name not in self.layout:
+            return default
+        elif self.extra is not None and name in self.extra:
+            return self.extra[name]
+        return _number_str(getattr(self, name))
+
+    @property
+    def attrib(self):
+        """Dict of the attributes as strings, in file order."""
+        return {name: self.get(name) for name in self.layout}
+
+    def to_record(self):
+        """Convert to the equivalent osm_parser.OsmRecord."""
+        record = osm_parser.OsmRecord(self.tag, self.attrib)
+        record.tags = list(self.tags)
+        if self.nd_refs is not None:
+            record.nd_refs = [str(ref) for ref in self.nd_refs]
+        record.members = [(member_type, str(ref), role)
+                          for member_type, ref, role in self.members]
+        return record
+
+
+def _number_str(value):
+    """Canonical string of an attribute value: repr of floats, str of ints
+    and strings."""
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _intern_value(value):
+    if len(value) <= INTERN_VALUE_LENGTH:
+        return sys.intern(value)
+    return value
+
+
+def iter_elements(osm_file, tags=None):
+    """Yield an OsmElement for every top-level element of osm_file, parsed
+    with expat like osm_parser.iter_records.
+
+    :osm_file: osm file name (possibly compressed, see osm_io.py) or file
+               object opened in binary mode
+    :tags: tags of the elements to yield, all of them (including the root,
+           which is yielded last as an osm_parser.OsmRecord) if None
+    """
+    if isinstance(osm_file, str):
+        with osm_io.open_input(osm_file) as f:
+            yield from iter_elements(f, tags)
+        return
+
+    # children are collected in lists, and stored in the element in their
+    # compact form when it is complete
+    elements = []
+    element = None
+    root = None
+    element_tags = []
+    element_refs = []
+    element_members = []
+    intern = sys.intern
+
+    def finish():
+        if element_tags:
+            element.tags = tuple(element_tags)
+            element_tags.clear()
+        if element_refs:
+            element.nd_refs = array("q", element_refs)
+            element_refs.clear()
+        if element_members:
+            element.members = tuple(element_members)
+            element_members.clear()
+        if tags is None or element.tag in tags:
+            elements.append(element)
+
+    def start(name, attrs):
+        nonlocal element, root
+        if name == "nd":
+            element_refs.append(int(attrs["ref"]))
+        elif name == "tag":
+            element_tags.append((intern(attrs["k"]),
+                                 _intern_value(attrs["v"])))
+        elif name == "member":
+            element_members.append((intern(attrs["type"]), int(attrs["ref"]),
+                                    intern(attrs["role"])))
+        elif root is None:
+            root = osm_parser.OsmRecord(name, attrs)
+        else:
+            if element is not None:
+                finish()
+            element = OsmElement(name, attrs)
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start
+
+    while True:
+        data = osm_file.read(osm_parser.READ_SIZE)
+        parser.Parse(data, not data)
+        if elements:
+            yield from elements
+            elements.clear()
+        if not data:
+            break
+
+    if element is not None:
+        finish()
+        yield from elements
+    if root is not None and (tags is None or root.tag in tags):
+        yield root
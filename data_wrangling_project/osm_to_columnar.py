@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: osm_to_columnar.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Export "node" and "way" elements of an osm file to columnar tables, as an
+alternative to the json lines of osm_to_json.py:
+    - nodes: id, lat, lon, version, changeset, timestamp, user, uid
+    - ways: id, version, changeset, timestamp, user, uid
+    - way_nodes: way_id, position, node_id (one row per "nd" of a way)
+    - tags: element_type, element_id, key, value (one row per "tag")
+
+The file is parsed once with the compact backend of osm_parser.py. Rows
+are collected in batches of row_group_size and each batch is written as
+it is full, so memory use does not depend on the size of the file:
+    - parquet (if pyarrow is installed): out_dir/<table>.parquet, one row
+      group per batch, which allows column pruning and predicate pushdown
+      when reading
+    - npz (otherwise): out_dir/<table>/part-<n>.npz, one numpy array per
+      column in every part. A string column is stored as two arrays, the
+      concatenated utf-8 bytes (<column>.data) and the offsets of the
+      values in them (<column>.offsets), so values are not padded to the
+      longest one and no pickle is needed. Missing values are stored as ""
+      for strings, NaN for floats and INT_NULL for integers.
+Writing a table removes the output of the other format left by an earlier
+export to the same directory. read_table loads a table back into a pandas
+DataFrame from either format.
+
+Usage:
+    python osm_to_columnar.py dallas.osm dallas_tables
+    python osm_to_columnar.py dallas.osm dallas_tables --format npz
+"""
+import glob
+import os
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+import osm_parser
+
+FORMATS = ["parquet", "npz"]
+
+# rows written at once, i.e. rows in a parquet row group or an npz part
+ROW_GROUP_SIZE = 128 * 1024
+
+# missing integer value in npz files
+INT_NULL = np.iinfo(np.int64).min
+
+# column names and types of each table
+SCHEMAS = {
+        "nodes": [("id", "int64"), ("lat", "float64"), ("lon", "float64"),
+                  ("version", "int64"), ("changeset", "int64"),
+                  ("timestamp", "string"), ("user", "string"),
+                  ("uid", "int64")],
+        "ways": [("id", "int64"), ("version", "int64"),
+                 ("changeset", "int64"), ("timestamp", "string"),
+                 ("user", "string"), ("uid", "int64")],
+        "way_nodes": [("way_id", "int64"), ("position", "int64"),
+                      ("node_id", "int64")],
+        "tags": [("element_type", "string"), ("element_id", "int64"),
+                 ("key", "string"), ("value", "string")],
+        }
+
+TAGS_TO_PROCESS = ["node", "way"]
+
+
+def default_format():
+    """"parquet" if pyarrow is installed, "npz" otherwise."""
+    return "parquet" if pa is not None else "npz"
+
+
+class TableWriter(object):
+    """Collect the rows of a table column by column and write them in
+    batches."""
+
+    def __init__(self, out_dir, name, file_format, row_group_size):
+        """
+        :out_dir: output directory
+        :name: table name, a key of SCHEMAS
+        :file_format: "parquet" or "npz"
+        :row_group_size: rows written at once
+        """
+        self.name = name
+        self.schema = SCHEMAS[name]
+        self.columns = [[] for _ in self.schema]
+        self.file_format = file_format
+        self.row_group_size = row_group_size
+        self.rows = 0
+        self.parts = 0
+
+        if file_format == "parquet":
+            if pa is None:
+                raise ImportError("pyarrow is required for parquet output: "
+                                  "pip install pyarrow")
+            self.arrow_schema = pa.schema(
+                    [(column, pa.type_for_alias(kind))
+                     for column, kind in self.schema])
+            _remove_npz(out_dir, name)
+            self.writer = pq.ParquetWriter(
+                    os.path.join(out_dir, name + ".parquet"),
+                    self.arrow_schema)
+        else:
+            parquet_file = os.path.join(out_dir, name + ".parquet")
+            if os.path.exists(parquet_file):
+                os.remove(parquet_file)
+            _remove_npz(out_dir, name)
+            self.path = os.path.join(out_dir, name)
+            os.makedirs(self.path, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, *row):
+        """Add a row, with one value per column of the schema."""
+        for column, value in zip(self.columns, row):
+            column.append(value)
+        if len(self.columns[0]) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """Write the collected rows."""
+        n = len(self.columns[0])
+        if n == 0:
+            return
+
+        if self.file_format == "parquet":
+            table = pa.Table.from_pydict(
+                    {column: values for (column, _), values
+                     in zip(self.schema, self.columns)},
+                    schema=self.arrow_schema)
+            self.writer.write_table(table, row_group_size=n)
+        else:
+            arrays = {}
+            for (column, kind), values in zip(self.schema, self.columns):
+                if kind == "string":
+                    (arrays[column + ".data"],
+                     arrays[column + ".offsets"]) = _encode_strings(values)
+                else:
+                    arrays[column] = _to_numpy(values, kind)
+            np.savez(os.path.join(self.path,
+                                  "part-{:05d}.npz".format(self.parts)),
+                     **arrays)
+
+        self.rows += n
+        self.parts += 1
+        self.columns = [[] for _ in self.schema]
+
+    def close(self):
+        """Write the remaining rows and close the output."""
+        self.flush()
+        if self.file_format == "parquet":
+            self.writer.close()
+
+
+def _remove_npz(out_dir, name):
+    path = os.path.join(out_dir, name)
+    for old in glob.glob(os.path.join(path, "part-*.npz")):
+        os.remove(old)
+    if os.path.isdir(path) and not os.listdir(path):
+        os.rmdir(path)
+
+
+def _encode_strings(values):
+    """utf-8 bytes of values as a uint8 array, and the n + 1 offsets of the
+    values in it."""
+    encoded = [b"" if value is None else value.encode("utf-8")
+               for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _decode_strings(data, offsets):
+    """Object array of the strings encoded by _encode_strings."""
+    buffer = data.tobytes()
+    bounds = offsets.tolist()
+    strings = np.empty(len(bounds) - 1, dtype=object)
+    strings[:] = [buffer[start:end].decode("utf-8")
+                  for start, end in zip(bounds[:-1], bounds[1:])]
+    return strings
+
+
+def _to_numpy(values, kind):
+    if kind == "float64":
+        return np.array([np.nan if value is None else value
+                         for value in values], dtype=np.float64)
+    return np.array([INT_NULL if value is None else value
+                     for value in values], dtype=np.int64)
+
+
+def export(osm_file, out_dir, file_format=None, row_group_size=ROW_GROUP_SIZE):
+    """Write the "node" and "way" elements of osm_file to columnar tables.
+
+    :osm_file: original osm data, possibly compressed (see osm_io.py)
+    :out_dir: directory of the tables, created if needed
+    :file_format: "parquet" or "npz", default_format() if None
+    :row_group_size: rows collected before writing a batch
+    :returns: a dict with table name as key and number of rows as value
+
+    """
+    if file_format is None:
+        file_format = default_format()
+    if file_format not in FORMATS:
+        raise ValueError("Unknown format: {}".format(file_format))
+    os.makedirs(out_dir, exist_ok=True)
+
+    writers = {name: TableWriter(out_dir, name, file_format, row_group_size)
+               for name in SCHEMAS}
+    nodes, ways = writers["nodes"], writers["ways"]
+    way_nodes, tags = writers["way_nodes"], writers["tags"]
+
+    try:
+        for element in osm_parser.parse(osm_file, TAGS_TO_PROCESS,
+                                        "compact"):
+            if element.tag == "node":
+                nodes.append(element.id, element.lat, element.lon,
+                             element.version, element.changeset,
+                             element.timestamp, element.user, element.uid)
+            else:
+                ways.append(element.id, element.version, element.changeset,
+                            element.timestamp, element.user, element.uid)
+                for position, ref in enumerate(element.nd_refs or ()):
+                    way_nodes.append(element.id, position, ref)
+
+            for key, value in element.tags:
+                tags.append(element.tag, element.id, key, value)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return {name: writer.rows for name, writer in writers.items()}
+
+
+def read_table(out_dir, name, columns=None, filters=None):
+    """Read a table written by export into a pandas DataFrame.
+
+    :out_dir: directory of the tables
+    :name: table name, a key of SCHEMAS
+    :columns: columns to read, all of them if None
+    :filters: pyarrow filters, e.g. [("key", "==", "addr:postcode")];
+              only supported for parquet tables
+    :returns: a pandas.DataFrame
+
+    """
+    import pandas as pd
+
+    parquet_file = os.path.join(out_dir, name + ".parquet")
+    if os.path.exists(parquet_file):
+        if pa is None:
+            raise ImportError("pyarrow is required to read parquet tables")
+        return pq.read_table(parquet_file, columns=columns,
+                             filters=filters).to_pandas()
+
+    if filters is not None:
+        raise ValueError("filters are only supported for parquet tables")
+
+    kinds = dict(SCHEMAS[name])
+    if columns is None:
+        columns = [column for column, _ in SCHEMAS[name]]
+    parts = sorted(glob.glob(os.path.join(out_dir, name, "part-*.npz")))
+    data = {column: [] for column in columns}
+    for part in parts:
+        with np.load(part) as arrays:
+            for column in columns:
+                if kinds[column] == "string":
+                    data[column].append(_decode_strings(
+                        arrays[column + ".data"], arrays[column + ".offsets"]))
+                else:
+                    data[column].append(arrays[column])
+    return pd.DataFrame({column: np.concatenate(arrays) if arrays else []
+                         for column, arrays in data.items()})
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+            description="Export osm nodes, ways and tags to columnar tables.")
+    parser.add_argument("osm_file")
+    parser.add_argument("out_dir")
+    parser.add_argument("--format", choices=FORMATS, default=None,
+            help="output format (default: parquet if pyarrow is installed, "
+                 "npz otherwise)")
+    parser.add_argument("--row-group-size", type=int, default=ROW_GROUP_SIZE,
+            help="rows per parquet row group or npz part")
+    args = parser.parse_args()
+
+    counts = export(args.osm_file, args.out_dir, args.format,
+                    args.row_group_size)
+    for name in SCHEMAS:
+        print("{:10s} {:10d} rows".format(name, counts[name]))
@@ -84,6 +84,13 @@ import re
 import codecs
 import json
 
+import json_writer
+import osm_chunks
+import osm_io
+import osm_parser
+import osm_record
+import stage_cache
+
 # if true, name conversion will be printed to screen
 __DEBUG__ = True
 
@@ -103,7 +110,7 @@ def get_created(element):
       "uid"       :  "1219059"
     }
 
-    :element: xml.etree.ElementTree.Element object
+    :element: xml.etree.ElementTree.Element object or osm_parser.OsmRecord
     :returns: a dictionary with info related to "created" (or empty dictionary)
 
     """
@@ -118,7 +125,7 @@ def get_pos(element):
     """Get position information [lattitude, longitude] related to element
         [41.9757030, -87.6921867]
 
-    :element: xml.etree.ElementTree.Element object
+    :element: xml.etree.ElementTree.Element object or osm_parser.OsmRecord
     :returns: a 2-element list [lattitude, longitude];
               if either lon or lat does not exist, None is returned
     """
@@ -140,13 +147,12 @@ def get_address(element):
         from second level tags with "k" value starting with "addr:"
         Ignore the tag if there is a second ":" in its "k" value
 
-    :element: xml.etree.ElementTree.Element object
+    :element: xml.etree.ElementTree.Element object or osm_parser.OsmRecord
     :returns: a dictionary with address or empty dictionary
 
     """
     address = {}
-    for tag in element.iter("tag"):
-        key, value = tag.attrib["k"], tag.attrib["v"]
+    for key, value in osm_parser.tag_pairs(element):
         if problemchars.search(key):
             continue
         elif key.startswith("addr:"):
@@ -165,25 +171,26 @@ def get_nd_refs(element):
     should be turned into
     "node_refs": ["305896090", "1719825889"]
 
-    :element: xml.etree.ElementTree.Element object
+    :element: xml.etree.ElementTree.Element object or osm_parser.OsmRecord
     :returns: a list of reference node for tag "way"
               or an empty list if not existing
 
     """
-    node_refs = []
-    for nd in element.iter("nd"):
-        node_refs.append(nd.attrib["ref"])
-    return node_refs
+    return list(osm_parser.nd_refs(element))
 
 def shape_element(element):
     """Convert top level tags "node" and "way" to proper dictionary.
     The element is cleard after processing to save memory.
 
-    :element: xml.etree.ElementTree.Element object
+    :element: xml.etree.ElementTree.Element object, osm_parser.OsmRecord or
+              osm_record.OsmElement
     :returns: a dictionary for "node" or "way";
               an empty dictionary for other top level tags
 
     """
+    if isinstance(element, osm_record.OsmElement):
+        element = element.to_record()
+
     node = {}
 
     node["type"] = "node" if element.tag == "node" else "way"
@@ -215,8 +222,7 @@ def shape_element(element):
     #ignore if it is address or has problematic characters in "k" value
     #some tag "k" value is "type", to avoid overwriting element type,
     #rename it to tag_type
-    for tag in element.iter("tag"):
-        key, value = tag.attrib["k"], tag.attrib["v"]
+    for key, value in osm_parser.tag_pairs(element):
         if problemchars.search(key):
             continue
         if key.startswith("addr:"):
@@ -227,32 +233,133 @@ def shape_element(element):
 
     return node
 
-def process_map(osm_file, json_file, pretty=True):
-    """Convert "node" and "way" tags in osm_file to json stored in json_file.
+def add_geometry(el, store):
+    """Add the "geometry" of a way dictionary, see node_store.way_geometry.
 
-    :osm_file: original osm data
-    :json_file: file to store json data
-    :pretty": write json data to file in a human readable format if True
+    :el: dictionary from shape_element
+    :store: node_store.NodeStore object
+    """
+    import node_store
+
+    if el.get("type") == "way":
+        el["geometry"] = node_store.way_geometry(store,
+                [int(ref) for ref in el.get("node_refs", [])])
 
+def open_store(store_dir):
+    """Open the node_store.NodeStore in store_dir, None if store_dir is None.
+    node_store, which requires numpy, is only imported if a store is used.
     """
-    with open(json_file, "w", encoding="utf-8") as fo:
+    if not store_dir:
+        return None
+    import node_store
+    return node_store.NodeStore(store_dir)
 
-        context = ET.iterparse(osm_file, events=('start', 'end'))
+def shape_chunk(osm_file, start, end, pretty, fast, backend="etree",
+        store_dir=None):
+    """Convert "node" and "way" tags in a byte range of osm_file to json.
 
-        _, root = next(context)
+    :osm_file: original osm data
+    :start, end: byte range from osm_chunks.find_chunks
+    :pretty, fast, backend, store_dir: same as in process_map
+    :returns: utf-8 json for the range, as process_map would write it
+
+    """
+    dumps = json_writer.get_dumps(pretty, fast)
+    store = open_store(store_dir)
+    output = []
+    for element in osm_chunks.iter_chunk_elements(osm_file, start, end,
+            TAGS_TO_PROCESS, backend):
+        el = shape_element(element)
+        if el:
+            if store is not None:
+                add_geometry(el, store)
+            output.append(dumps(el))
+    return b"".join(output)
+
+def process_map(osm_file, json_file, pretty=False, processes=1, fast=True,
+        backend="etree", store_dir=None):
+    """Convert "node" and "way" tags in osm_file to json stored in json_file.
+
+    :osm_file: original osm data, possibly compressed (see osm_io.py)
+    :json_file: file to store json data, compressed according to its
+                extension
+    :pretty": write json data to file in a human readable format if True,
+              otherwise write one compact json object per line
+    :processes: number of processes to convert with. If more than one,
+                osm_file is split into byte ranges converted in parallel;
+                the output is identical to the one of a single process.
+                A compressed osm_file is converted by a single process.
+    :fast: use orjson for compact output if it is installed
+    :backend: parser backend, "etree" or "expat" (see osm_parser.py)
+    :store_dir: directory of the node_store.NodeStore of osm_file; if
+                given, the coordinates, length and bounding box of ways
+                are added to them as "geometry"
 
-        #for _, element in ET.iterparse(osm_file):
-        for event, element in context:
-            if event == 'end' and element.tag in TAGS_TO_PROCESS:
-                el = shape_element(element)
-                if el:
-                    if pretty:
-                        fo.write(json.dumps(el, indent=2)+"\n")
-                    else:
-                        fo.write(json.dumps(el) + "\n")
-                root.clear()
+    """
+    if osm_io.is_compressed(osm_file):
+        processes = 1
+
+    with osm_io.open_output(json_file) as fo, \
+            json_writer.JsonWriter(fo, pretty, fast) as writer:
+
+        if processes > 1:
+            for data in osm_chunks.map_chunks(shape_chunk, osm_file,
+                    processes, pretty, fast, backend, store_dir):
+                writer.write_raw(data)
+            return
+
+        store = open_store(store_dir)
+        for element in osm_parser.parse(osm_file, TAGS_TO_PROCESS, backend):
+            el = shape_element(element)
+            if el:
+                if store is not None:
+                    add_geometry(el, store)
+                writer.write(el)
 
 if __name__ == "__main__":
-    import sys
-    osm_file, json_file= sys.argv[1:]
-    process_map(osm_file, json_file)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert osm to json.")
+    parser.add_argument("osm_file")
+    parser.add_argument("json_file")
+    parser.add_argument("processes", type=int, nargs="?", default=1)
+    parser.add_argument("--pretty", action="store_true",
+            help="write indented json instead of one object per line")
+    parser.add_argument("--backend", choices=osm_parser.BACKENDS,
+            default="etree", help="xml parser backend (default: etree)")
+    parser.add_argument("--geometry", metavar="STORE_DIR",
+            help="add way geometries, using (and building if needed) the "
+                 "node store in STORE_DIR")
+    parser.add_argument("--cache", metavar="DIR",
+            help="reuse the output of a previous run on the same input and "
+                 "options cached in DIR (see stage_cache.py)")
+    args = parser.parse_args()
+
+    def run():
+        if args.geometry is not None:
+            import node_store
+            node_store.load_or_build(args.osm_file, args.geometry)
+        process_map(args.osm_file, args.json_file, args.pretty,
+                    args.processes, backend=args.backend,
+                    store_dir=args.geometry)
+
+    if args.cache is None:
+        run()
+    else:
+        import os
+        import sys
+
+        modules = [sys.modules[__name__], json_writer]
+        modules += stage_cache.reader_modules()
+        if args.geometry is not None:
+            import node_store
+            modules.append(node_store)
+        key = stage_cache.make_key("osm_to_json", [args.osm_file],
+                {"pretty": args.pretty, "geometry": args.geometry is not None,
+                 "output": os.path.splitext(args.json_file)[1],
+                 "serializer": json_writer.serializer_name(args.pretty)},
+                [stage_cache.code_version(*modules)])
+        _, hit = stage_cache.StageCache(args.cache).run(key, run,
+                                                         [args.json_file])
+        if hit:
+            print("reused cached output", file=sys.stderr)
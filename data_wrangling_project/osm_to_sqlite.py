@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: osm_to_sqlite.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Load the dictionaries produced by osm_to_json.shape_element into a SQLite
+database, normally from a file cleaned by clean_osm.py. Tables:
+    - nodes: id, lat, lon, user, uid, version, changeset, timestamp
+    - ways: id, user, uid, version, changeset, timestamp
+    - way_nodes: way_id, node_id, position
+    - node_tags, way_tags: id, key, value, type
+
+In the tag tables, "type" is "addr" for the "address" entries of the
+dictionary, stored with their key without the "addr:" prefix, and
+"regular" for the other tags. "tag_type" is stored back as "type". The
+"id" and "visible" attributes are not stored as tags.
+
+The file is streamed through shape_element; rows are inserted with
+executemany in batches of batch_size, in transactions of
+rows_per_transaction rows, with the database in WAL mode. Indexes are
+created once all rows are loaded, which is much faster than keeping them
+up to date while inserting.
+
+Usage:
+    python osm_to_sqlite.py dallas_clean.osm dallas.db
+    python osm_to_sqlite.py dallas_clean.osm dallas.db --batch-size 5000
+    python osm_to_sqlite.py dallas_clean.osm --benchmark 100,1000,10000
+"""
+import os
+import sqlite3
+import tempfile
+import time
+
+import osm_parser
+import osm_to_json
+
+# rows inserted by one executemany call
+BATCH_SIZE = 10000
+
+# rows inserted between two commits
+ROWS_PER_TRANSACTION = 1000000
+
+SCHEMA = """
+CREATE TABLE nodes (
+    id INTEGER PRIMARY KEY,
+    lat REAL,
+    lon REAL,
+    user TEXT,
+    uid INTEGER,
+    version INTEGER,
+    changeset INTEGER,
+    timestamp TEXT
+);
+CREATE TABLE ways (
+    id INTEGER PRIMARY KEY,
+    user TEXT,
+    uid INTEGER,
+    version INTEGER,
+    changeset INTEGER,
+    timestamp TEXT
+);
+CREATE TABLE way_nodes (
+    way_id INTEGER NOT NULL,
+    node_id INTEGER NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE TABLE node_tags (
+    id INTEGER NOT NULL,
+    key TEXT,
+    value TEXT,
+    type TEXT
+);
+CREATE TABLE way_tags (
+    id INTEGER NOT NULL,
+    key TEXT,
+    value TEXT,
+    type TEXT
+);
+"""
+
+# created after loading
+INDEXES = """
+CREATE INDEX way_nodes_way ON way_nodes (way_id, position);
+CREATE INDEX way_nodes_node ON way_nodes (node_id);
+CREATE INDEX node_tags_id ON node_tags (id);
+CREATE INDEX node_tags_key ON node_tags (key, value);
+CREATE INDEX way_tags_id ON way_tags (id);
+CREATE INDEX way_tags_key ON way_tags (key, value);
+"""
+
+INSERTS = {
+        "nodes": "INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        "ways": "INSERT INTO ways VALUES (?, ?, ?, ?, ?, ?)",
+        "way_nodes": "INSERT INTO way_nodes VALUES (?, ?, ?)",
+        "node_tags": "INSERT INTO node_tags VALUES (?, ?, ?, ?)",
+        "way_tags": "INSERT INTO way_tags VALUES (?, ?, ?, ?)",
+        }
+
+# keys of a shaped dictionary which are not tags
+NOT_TAGS = frozenset(["type", "created", "pos", "address", "node_refs", "id",
+                      "visible"])
+
+
+def _int(value):
+    return None if value is None else int(value)
+
+
+def element_rows(el):
+    """Split a dictionary from shape_element into table rows.
+
+    :el: dictionary for a "node" or a "way"
+    :returns: a list of (table name, row) tuples
+
+    """
+    element_id = int(el["id"])
+    created = el.get("created", {})
+    user, uid = created.get("user"), _int(created.get("uid"))
+    version = _int(created.get("version"))
+    changeset = _int(created.get("changeset"))
+    timestamp = created.get("timestamp")
+
+    rows = []
+    if el["type"] == "node":
+        lat, lon = el.get("pos", (None, None))
+        rows.append(("nodes", (element_id, lat, lon, user, uid, version,
+                               changeset, timestamp)))
+        tag_table = "node_tags"
+    else:
+        rows.append(("ways", (element_id, user, uid, version, changeset,
+                              timestamp)))
+        for position, ref in enumerate(el.get("node_refs", ())):
+            rows.append(("way_nodes", (element_id, int(ref), position)))
+        tag_table = "way_tags"
+
+    for key, value in el.get("address", {}).items():
+        rows.append((tag_table, (element_id, key, value, "addr")))
+    for key, value in el.items():
+        if key not in NOT_TAGS:
+            if key == "tag_type":
+                key = "type"
+            rows.append((tag_table, (element_id, key, value, "regular")))
+    return rows
+
+
+def create_database(db_file):
+    """Create an empty database with the tables, without indexes.
+
+    :db_file: database file name, removed first if it exists
+    :returns: a sqlite3.Connection in autocommit mode
+
+    """
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_file + suffix):
+            os.remove(db_file + suffix)
+
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def load(osm_file, db_file, batch_size=BATCH_SIZE,
+        rows_per_transaction=ROWS_PER_TRANSACTION, backend="expat"):
+    """Load the "node" and "way" elements of osm_file into a new database.
+
+    :osm_file: osm data, possibly compressed (see osm_io.py)
+    :db_file: database file name, replaced if it exists
+    :batch_size: rows inserted by one executemany call
+    :rows_per_transaction: rows inserted between two commits
+    :backend: parser backend, see osm_parser.py
+    :returns: a dict with table name as key and number of rows as value
+
+    """
+    conn = create_database(db_file)
+    batches = {table: [] for table in INSERTS}
+    counts = {table: 0 for table in INSERTS}
+    pending = 0
+
+    def insert(table):
+        conn.executemany(INSERTS[table], batches[table])
+        counts[table] += len(batches[table])
+        batches[table] = []
+
+    try:
+        conn.execute("BEGIN")
+        for element in osm_parser.parse(osm_file,
+                                        osm_to_json.TAGS_TO_PROCESS, backend):
+            el = osm_to_json.shape_element(element)
+            for table, row in element_rows(el):
+                batch = batches[table]
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    insert(table)
+                    pending += batch_size
+                    if pending >= rows_per_transaction:
+                        conn.execute("COMMIT")
+                        conn.execute("BEGIN")
+                        pending = 0
+
+        for table in INSERTS:
+            insert(table)
+        conn.execute("COMMIT")
+
+        conn.executescript(INDEXES)
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+    return counts
+
+
+def benchmark(osm_file, batch_sizes, backend="expat"):
+    """Time the load of osm_file into a temporary database for several
+    batch sizes, index creation included.
+
+    :returns: a list of (batch size, rows, seconds) tuples
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "benchmark.db")
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            counts = load(osm_file, db_file, batch_size, backend=backend)
+            seconds = time.perf_counter() - start
+            results.append((batch_size, sum(counts.values()), seconds))
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+            description="Load osm nodes and ways into a SQLite database.")
+    parser.add_argument("osm_file")
+    parser.add_argument("db_file", nargs="?")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+            help="rows per executemany call (default: {})".format(BATCH_SIZE))
+    parser.add_argument("--backend", choices=osm_parser.BACKENDS,
+            default="expat", help="xml parser backend (default: expat)")
+    parser.add_argument("--benchmark", metavar="SIZES",
+            type=lambda sizes: [int(size) for size in sizes.split(",")],
+            help="time the load for comma separated batch sizes")
+    args = parser.parse_args()
+
+    if args.benchmark is not None:
+        for batch_size, rows, seconds in benchmark(args.osm_file,
+                args.benchmark, args.backend):
+            print("batch size {:8d}: {:10d} rows {:8.2f} s {:10.0f} rows/s"
+                  .format(batch_size, rows, seconds, rows / seconds))
+    elif args.db_file is None:
+        parser.error("db_file is required unless --benchmark is given")
+    else:
+        start = time.perf_counter()
+        counts = load(args.osm_file, args.db_file, args.batch_size,
+                      backend=args.backend)
+        seconds = time.perf_counter() - start
+        for table in INSERTS:
+            print("{:10s} {:10d} rows".format(table, counts[table]))
+        print("{:.0f} rows/s".format(sum(counts.values()) / seconds))
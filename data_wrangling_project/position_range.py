@@ -5,38 +5,342 @@ File: position_range.py
 Author: Yang Yang
 Email: yyangbian@gmail.com
 Github: yyangbian
-Description: Get min and max of lattitude and longitude from the osm file
+Description: Get min and max of lattitude and longitude from the osm file,
+and count the positions outside of the expected bounds.
+
+Positions are summarized while streaming, in constant memory:
+    - min, max, mean and standard deviation (Welford's algorithm)
+    - quantiles, from a histogram of HISTOGRAM_BINS bins between the
+      bounds, plus one bin for values below and one for values above them
+    - number of positions out of bounds, by element type
+Partial results of byte ranges of the file are merged, so the audit can
+run in parallel (see osm_chunks.py).
+
+The bounds are read from the "bounds" element of the file. If the file has
+none, the expected bounds of the Dallas extract below are used, by
+run_position_audit as well as in a single pass with other audits
+(audit_osm.py), the same bounds spatial_index.py checks against.
+
+Usage:
+    python position_range.py dallas.osm
+    python position_range.py dallas.osm --processes 4 --histogram dallas
 """
-import xml.etree.cElementTree as ET
+import csv
 import pprint
+import xml.etree.cElementTree as ET
+
+import audit_engine
+import osm_chunks
+import osm_io
+import osm_parser
 
-# min/max values is from bound tag in the osm file
+# min/max values is from bound tag in the Dallas osm file, used when a
+# file has no bound tag
 MIN_LAT = 32.166
 MAX_LAT = 33.431
 
 MIN_LON = -97.789
 MAX_LON = -96.113
 
+# bins of the histograms between the bounds
+HISTOGRAM_BINS = 1000
+
+QUANTILES = [0.01, 0.25, 0.5, 0.75, 0.99]
+
+EXPECTED_BOUNDS = (MIN_LAT, MAX_LAT, MIN_LON, MAX_LON)
+
+
+def element_bounds(elem):
+    """(min lat, max lat, min lon, max lon) of a "bounds" element."""
+    return tuple(float(elem.get(name))
+                 for name in ("minlat", "maxlat", "minlon", "maxlon"))
+
+
+def read_bounds(osm_file):
+    """Read the "bounds" element at the head of osm_file.
+
+    :osm_file: osm file name, possibly compressed (see osm_io.py)
+    :returns: (min lat, max lat, min lon, max lon), None if there is no
+              "bounds" element before the first node, way or relation
+
+    """
+    with osm_io.open_input(osm_file) as f:
+        for _, elem in ET.iterparse(f, events=("start",)):
+            if elem.tag == "bounds":
+                return element_bounds(elem)
+            if elem.tag in ("node", "way", "relation"):
+                return None
+    return None
+
+
+def out_of_bounds(lat=None, lon=None):
+    """Check positions against MIN_LAT, MAX_LAT, MIN_LON and MAX_LON.
+
+    :lat: array-like of lattitudes, or None
+    :lon: array-like of longitudes of the same length, or None
+    :returns: a numpy bool array, True where lat or lon is out of bounds
+
+    """
+    import numpy as np
+
+    mask = None
+    for values, low, high in ((lat, MIN_LAT, MAX_LAT),
+                              (lon, MIN_LON, MAX_LON)):
+        if values is None:
+            continue
+        values = np.asarray(values, dtype=np.float64)
+        outside = (values < low) | (values > high)
+        mask = outside if mask is None else mask | outside
+    return mask
+
+
+class StreamStats(object):
+    """Summary of a stream of values in constant memory, mergeable with
+    the summary of another stream over the same bounds."""
+
+    def __init__(self, low, high, bins=HISTOGRAM_BINS):
+        """
+        :low, high: bounds of the histogram, low < high
+        :bins: number of bins between low and high
+        """
+        if not low < high:
+            raise ValueError("Empty histogram range: {} to {}".format(low,
+                                                                    high))
+        self.low = low
+        self.high = high
+        self.bins = bins
+        self.width = (high - low) / bins
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        # counts[0] is below low, counts[-1] above high
+        self.counts = [0] * (bins + 2)
+
+    def add(self, x):
+        """Add the value x."""
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+        if x < self.low:
+            self.counts[0] += 1
+        elif x > self.high:
+            self.counts[-1] += 1
+        else:
+            self.counts[min(int((x - self.low) / self.width),
+                            self.bins - 1) + 1] += 1
+
+    def merge(self, other):
+        """Add the values summarized by other, a StreamStats with the same
+        bounds and bins."""
+        if (other.low, other.high, other.bins) != (self.low, self.high,
+                                                   self.bins):
+            raise ValueError("Can't merge statistics of different bins")
+        if other.count == 0:
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
 
-def audit_position(osm_file):
-    lon = []
-    lat = []
-    for event, elem in ET.iterparse(osm_file):
-        if elem.tag == "node" or elem.tag == "way":
-            if "lat" in elem.attrib:
-                lat.append(float(elem.attrib["lat"]))
-            if "lon" in elem.attrib:
-                lon.append(float(elem.attrib["lon"]))
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
 
-        elem.clear()
+    def variance(self):
+        """Sample variance, None for less than two values."""
+        if self.count < 2:
+            return None
+        return self.m2 / (self.count - 1)
 
-    return { "lat": [min(lat), max(lat)],
-             "lon": [min(lon), max(lon)]
-            }
+    def std(self):
+        """Sample standard deviation, None for less than two values."""
+        variance = self.variance()
+        return None if variance is None else variance ** 0.5
 
+    def quantile(self, q):
+        """Approximate q-quantile, interpolated within its histogram bin.
+        Quantiles falling below or above the bounds are reported as the
+        min or the max.
+
+        :q: number between 0 and 1
+        :returns: the quantile, None if no value was added
+
+        """
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        seen = self.counts[0]
+        if rank <= seen:
+            return self.min
+        for i in range(1, self.bins + 1):
+            n = self.counts[i]
+            if n and rank <= seen + n:
+                value = self.low + (i - 1 + (rank - seen) / n) * self.width
+                return min(max(value, self.min), self.max)
+            seen += n
+        return self.max
+
+    def histogram(self):
+        """Yield (bin low, bin high, count) for every bin, the first and
+        last bins being (-inf, low) and (high, inf)."""
+        yield float("-inf"), self.low, self.counts[0]
+        for i in range(self.bins):
+            yield (self.low + i * self.width, self.low + (i + 1) * self.width,
+                   self.counts[i + 1])
+        yield self.high, float("inf"), self.counts[-1]
+
+    def result(self):
+        """Dictionary with count, min, max, mean, std and quantiles."""
+        return {"count": self.count,
+                "min": self.min,
+                "max": self.max,
+                "mean": self.mean if self.count else None,
+                "std": self.std(),
+                "quantiles": {q: self.quantile(q) for q in QUANTILES}}
+
+
+@audit_engine.register("position")
+class PositionAudit(audit_engine.Audit):
+    """Summarize lattitude and longitude of "node" and "way" elements."""
+
+    TAGS = ("bounds", "node", "way")
+
+    def __init__(self, bounds=None):
+        """
+        :bounds: (min lat, max lat, min lon, max lon) of the histograms and
+                 of the out of bounds counts; if None, the "bounds" element
+                 of the file is used when it comes before any position,
+                 EXPECTED_BOUNDS otherwise
+        """
+        self.fixed = bounds is not None
+        self.set_bounds(bounds if bounds is not None else EXPECTED_BOUNDS)
+        # {element type: {"lat": count, "lon": count}}
+        self.out_of_bounds = {}
+
+    def set_bounds(self, bounds):
+        self.bounds = bounds
+        min_lat, max_lat, min_lon, max_lon = bounds
+        self.lat = StreamStats(min_lat, max_lat)
+        self.lon = StreamStats(min_lon, max_lon)
+
+    def visit(self, elem):
+        if elem.tag == "bounds":
+            if not self.fixed and self.lat.count == self.lon.count == 0:
+                self.set_bounds(element_bounds(elem))
+                self.fixed = True
+            return
+
+        lat, lon = elem.get("lat"), elem.get("lon")
+        if lat is not None:
+            lat = float(lat)
+            self.lat.add(lat)
+            if lat < self.lat.low or lat > self.lat.high:
+                self._count_out_of_bounds(elem.tag, "lat")
+        if lon is not None:
+            lon = float(lon)
+            self.lon.add(lon)
+            if lon < self.lon.low or lon > self.lon.high:
+                self._count_out_of_bounds(elem.tag, "lon")
+
+    def _count_out_of_bounds(self, tag, axis):
+        counts = self.out_of_bounds.setdefault(tag, {"lat": 0, "lon": 0})
+        counts[axis] += 1
+
+    def merge(self, other):
+        """Add the positions seen by other, a PositionAudit."""
+        self.lat.merge(other.lat)
+        self.lon.merge(other.lon)
+        for tag, counts in other.out_of_bounds.items():
+            for axis, count in counts.items():
+                mine = self.out_of_bounds.setdefault(tag, {"lat": 0, "lon": 0})
+                mine[axis] += count
+
+    def result(self):
+        return { "lat": [self.lat.min, self.lat.max],
+                 "lon": [self.lon.min, self.lon.max],
+                 "stats": {"lat": self.lat.result(),
+                           "lon": self.lon.result()},
+                 "out_of_bounds": self.out_of_bounds
+                }
+
+
+def position_chunk(osm_file, start, end, backend="etree", bounds=None):
+    """Run a PositionAudit over a byte range of osm_file.
+
+    :start, end: byte range from osm_chunks.find_chunks
+    :bounds: bounds of the PositionAudit, the same for every range so the
+             results can be merged
+    :returns: the PositionAudit object
+    """
+    audit = PositionAudit(bounds)
+    for elem in osm_chunks.iter_chunk_elements(osm_file, start, end,
+            PositionAudit.TAGS, backend):
+        audit.visit(elem)
+    return audit
+
+
+def run_position_audit(osm_file, processes=1, backend="etree"):
+    """Run a PositionAudit over osm_file, in parallel if processes > 1 and
+    osm_file is not compressed. The bounds are read from the "bounds"
+    element of osm_file, EXPECTED_BOUNDS are used if it has none.
+
+    :returns: the PositionAudit object
+    """
+    bounds = read_bounds(osm_file) or EXPECTED_BOUNDS
+    if processes > 1 and not osm_io.is_compressed(osm_file):
+        audit = PositionAudit(bounds)
+        for partial in osm_chunks.map_chunks(position_chunk, osm_file,
+                processes, backend, bounds):
+            audit.merge(partial)
+        return audit
+
+    audit = PositionAudit(bounds)
+    audit_engine.run_audits(osm_file, [audit], backend)
+    return audit
+
+
+def audit_position(osm_file, processes=1, backend="etree"):
+    return run_position_audit(osm_file, processes, backend).result()
+
+
+def write_histogram(stats, csv_file):
+    """Write the histogram of a StreamStats object to a csv file."""
+    with open(csv_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["low", "high", "count"])
+        writer.writerows(stats.histogram())
 
 
 if __name__ == "__main__":
-    import sys
-    result = audit_position(sys.argv[1])
-    pprint.pprint(result)
+    import argparse
+
+    parser = argparse.ArgumentParser(
+            description="Summarize the positions of an osm file.")
+    parser.add_argument("osm_file")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--backend", choices=osm_parser.BACKENDS,
+            default="etree", help="xml parser backend (default: etree)")
+    parser.add_argument("--histogram", metavar="PREFIX",
+            help="write the histograms to PREFIX_lat.csv and PREFIX_lon.csv")
+    args = parser.parse_args()
+
+    audit = run_position_audit(args.osm_file, args.processes, args.backend)
+    pprint.pprint(audit.result())
+    if args.histogram is not None:
+        write_histogram(audit.lat, args.histogram + "_lat.csv")
+        write_histogram(audit.lon, args.histogram + "_lon.csv")
@@ -1,8 +1,57 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+"""
+File: sample_osm_file.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Create a smaller sample of an osm file. Supported samples:
+    - every k-th top level element (default: every 80th)
+    - a reservoir sample of a fixed number of elements, reproducible with a
+      seed
+    - a stratified sample taking a fixed fraction of the nodes, ways and
+      relations separately
 
+With --seek the elements are located with the offset index of osm_index.py
+and copied byte by byte instead of parsing the whole file; stratified
+samples always use the index since they need the number of elements of
+each type. Both need an uncompressed osm file.
+
+Each element is written with the whitespace following it (its tail), as
+in the file. Parsed elements are written by ET.tostring, which keeps the
+output of the default every 80th sample as it always was; copied elements
+keep their bytes as in the file, so they can differ in the details
+ET.tostring normalizes (" />", quoting, escaping). A parsed element read
+at the very end of a parser buffer can miss its tail.
+
+With --complete the nodes referenced by the sampled ways are added to the
+sample, so every "nd" of the sample can be resolved.
+
+Usage:
+    python sample_osm_file.py dallas.osm sample.osm
+    python sample_osm_file.py dallas.osm sample.osm -k 100 --seek
+    python sample_osm_file.py dallas.osm sample.osm --size 5000 --seed 1
+    python sample_osm_file.py dallas.osm sample.osm \\
+        --stratify node=0.01,way=0.01,relation=0.05 --seed 1 --complete
+"""
+import argparse
+import random
+import re
 import xml.etree.cElementTree as ET
 
+import osm_index
+import osm_io
+
+# reference to a node in a "way"
+ND_REF_RE = re.compile(rb'<nd\s+ref="(-?\d+)"')
+
+OSM_HEADER = b'<?xml version="1.0" encoding="UTF-8"?>\n<osm>\n'
+OSM_FOOTER = b'</osm>'
+
+# bytes read at once when looking for the end of an element tail
+TAIL_BLOCK = 256
+
 
 def get_element(osm_file, tags=('node', 'way', 'relation')):
     """Yield element if it is the right type of tag
@@ -14,18 +63,199 @@ def get_element(osm_file, tags=('node', 'way', 'relation')):
             yield elem
             root.clear()
 
-def main(osm_file, sample_file):
-    with open(sample_file, 'wb') as output:
-        output.write(bytes('<?xml version="1.0" encoding="UTF-8"?>\n', 'utf-8'))
-        output.write(bytes('<osm>\n', 'utf-8'))
 
-        # Write every 80th top level element
-        for i, element in enumerate(get_element(osm_file)):
-            if i % 80 == 0:
-                output.write(ET.tostring(element, encoding='utf-8'))
+def every_kth(items, k):
+    """Yield every k-th item, starting with the first one."""
+    for i, item in enumerate(items):
+        if i % k == 0:
+            yield item
+
+
+def reservoir(items, size, rng):
+    """Pick size items uniformly at random in a single pass (algorithm R).
+
+    :items: an iterable of any length
+    :size: number of items to pick
+    :rng: random.Random object
+    :returns: a list of the picked items, in their original order
+
+    """
+    picked = []
+    for i, item in enumerate(items):
+        if i < size:
+            picked.append((i, item))
+        else:
+            j = rng.randint(0, i)
+            if j < size:
+                picked[j] = (i, item)
+    return [item for _, item in sorted(picked, key=lambda pair: pair[0])]
+
+
+def parse_strata(text):
+    """Parse "node=0.01,way=0.02" into {"node": 0.01, "way": 0.02}."""
+    strata = {}
+    for part in text.split(","):
+        element_type, fraction = part.split("=")
+        if element_type not in osm_index.ELEMENT_TYPES:
+            raise ValueError("Unknown element type: {}".format(element_type))
+        strata[element_type] = float(fraction)
+    return strata
+
+
+def select_positions(index, k=None, size=None, strata=None, seed=None):
+    """Select elements of an indexed osm file.
+
+    Since the number of elements is known, the random samples are drawn
+    directly with random.sample instead of going through all elements.
+
+    :index: osm_index.OsmIndex object
+    :k: select every k-th element
+    :size: select size elements at random
+    :strata: a dict with element type as key and the fraction of the
+             elements of that type to select as value
+    :seed: seed of the random samples
+    :returns: a sorted list of positions in the index
+
+    """
+    rng = random.Random(seed)
+    if strata is not None:
+        positions = []
+        for element_type in osm_index.ELEMENT_TYPES:
+            candidates = index.positions(element_type)
+            n = int(round(len(candidates) * strata.get(element_type, 0)))
+            positions.extend(rng.sample(candidates, min(n, len(candidates))))
+        return sorted(positions)
+    elif size is not None:
+        return sorted(rng.sample(range(len(index)), min(size, len(index))))
+    else:
+        return list(range(0, len(index), k))
+
+
+def add_way_nodes(index, f, positions):
+    """Add the nodes referenced by the selected ways to positions.
+
+    :index: osm_index.OsmIndex object
+    :f: the indexed osm file opened in binary mode
+    :positions: sorted positions of the selected elements
+    :returns: sorted positions including the referenced nodes
+
+    """
+    selected = set(positions)
+    for i in positions:
+        if index.element_type(i) != "way":
+            continue
+        for ref in ND_REF_RE.findall(index.read(f, i)):
+            node = index.find("node", int(ref))
+            if node is not None:
+                selected.add(node)
+    return sorted(selected)
+
+
+def read_with_tail(index, f, i):
+    """Read the raw bytes of the i-th element followed by the whitespace
+    after it, like ET.tostring of a parsed element with its tail.
+
+    :index: osm_index.OsmIndex object
+    :f: the indexed osm file opened in binary mode
+    :i: position of the element in the index
+    """
+    data = index.read(f, i)
+    tail = []
+    while True:
+        block = f.read(TAIL_BLOCK)
+        text = block.lstrip(b" \t\r\n")
+        tail.append(block[:len(block) - len(text)])
+        if text or not block:
+            return data + b"".join(tail)
+
+
+def write_sample(sample_file, elements):
+    """Write serialized top level elements, with their tails, to
+    sample_file."""
+    with osm_io.open_output(sample_file) as output:
+        output.write(OSM_HEADER)
+        for data in elements:
+            output.write(data)
+        output.write(OSM_FOOTER)
+
+
+def sample_by_seek(osm_file, sample_file, k=None, size=None, strata=None,
+        seed=None, complete=False):
+    """Sample osm_file using its offset index, copying the raw bytes of the
+    selected elements. Arguments are the same as in main.
+
+    :raises ValueError: if osm_file is compressed, since it can't be read
+                        at random offsets
+    """
+    if osm_io.is_compressed(osm_file):
+        raise ValueError("Can't seek in compressed file {}, decompress it "
+                         "first".format(osm_file))
+    index = osm_index.load_or_build(osm_file)
+    positions = select_positions(index, k, size, strata, seed)
+
+    with open(osm_file, "rb") as f:
+        if complete:
+            positions = add_way_nodes(index, f, positions)
+        write_sample(sample_file,
+                     (read_with_tail(index, f, i) for i in positions))
+
+
+def main(osm_file, sample_file, k=80, size=None, strata=None, seed=None,
+        seek=False, complete=False):
+    """Write a sample of osm_file to sample_file.
+
+    :osm_file: original osm file, possibly compressed (see osm_io.py)
+    :sample_file: file to write the sample to, compressed according to its
+                  extension
+    :k: write every k-th top level element
+    :size: if given, write a random sample of size elements instead
+    :strata: if given, a dict with element type as key and the fraction of
+             the elements of that type to sample as value
+    :seed: seed of the random samples
+    :seek: read the selected elements using the offset index
+    :complete: add the nodes referenced by the sampled ways
+    :raises ValueError: if k is less than 1
+
+    """
+    if k < 1:
+        raise ValueError("k must be at least 1, got {}".format(k))
+    if seek or complete or strata is not None:
+        sample_by_seek(osm_file, sample_file, k, size, strata, seed, complete)
+        return
+
+    def serialize(elements):
+        for element in elements:
+            yield ET.tostring(element, encoding='utf-8')
 
-        output.write(bytes('</osm>', 'utf-8'))
+    # elements are picked first, so only the kept ones are serialized; the
+    # reservoir keeps the picked elements, which stay whole after
+    # get_element clears the root
+    with osm_io.open_input(osm_file) as f:
+        elements = get_element(f)
+        if size is not None:
+            picked = reservoir(elements, size, random.Random(seed))
+        else:
+            picked = every_kth(elements, k)
+        write_sample(sample_file, serialize(picked))
 
 if __name__ == '__main__':
-    import sys
-    main(sys.argv[1], sys.argv[2])
+    parser = argparse.ArgumentParser(description="Sample an osm file.")
+    parser.add_argument("osm_file")
+    parser.add_argument("sample_file")
+    parser.add_argument("-k", type=int, default=80,
+            help="write every k-th element (default: 80)")
+    parser.add_argument("--size", type=int,
+            help="write a random sample of SIZE elements")
+    parser.add_argument("--stratify", type=parse_strata, metavar="STRATA",
+            help="fraction per element type, e.g. node=0.01,way=0.01")
+    parser.add_argument("--seed", type=int, help="seed of random samples")
+    parser.add_argument("--seek", action="store_true",
+            help="read elements through the offset index")
+    parser.add_argument("--complete", action="store_true",
+            help="add the nodes referenced by sampled ways")
+    args = parser.parse_args()
+    try:
+        main(args.osm_file, args.sample_file, args.k, args.size,
+             args.stratify, args.seed, args.seek, args.complete)
+    except ValueError as e:
+        parser.error(str(e))
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: spatial_index.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Uniform grid index over the positions of the nodes of an osm file.
+
+The nodes are read in one streaming pass (compact parser backend) into
+numpy arrays, and sorted by grid cell; the index keeps, like a CSR
+matrix, the offset of the first node of every cell in the sorted arrays.
+The nodes of a row of cells are therefore contiguous, and a bounding box
+query only looks at one slice of the arrays per row of cells it covers
+before checking the exact positions. The cell size is chosen so that a
+cell holds about NODES_PER_CELL nodes on average, unless it is given.
+
+The index is saved next to the osm file as an .npz file and rebuilt when
+the osm file is newer. Besides bounding box and radius queries, it is
+used to
+    - validate all positions at once against the bounds of position_range
+    - extract the nodes within a bounding box, and the ways using them,
+      into a new osm file (with the offset index of osm_index.py)
+
+Usage:
+    python spatial_index.py build dallas.osm
+    python spatial_index.py bbox dallas.osm 32.7 -96.9 32.8 -96.7
+    python spatial_index.py radius dallas.osm 32.78 -96.8 500
+    python spatial_index.py validate dallas.osm
+    python spatial_index.py extract dallas.osm downtown.osm \\
+        32.77 -96.81 32.79 -96.79 --complete
+"""
+from array import array
+import math
+import os
+
+import numpy as np
+
+import osm_index
+import osm_parser
+import position_range
+import sample_osm_file
+
+# average number of nodes per cell when the cell size is not given
+NODES_PER_CELL = 16
+
+# mean earth radius in meters
+EARTH_RADIUS = 6371008.8
+
+
+class GridIndex(object):
+    """Node ids and positions sorted by grid cell, see the module
+    description."""
+
+    def __init__(self, ids, lat, lon, cell_size=None):
+        """
+        :ids, lat, lon: numpy arrays of node ids and positions
+        :cell_size: cell size in degrees, chosen from the number of nodes
+                    if None
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+
+        if len(ids):
+            self.min_lat, self.min_lon = float(lat.min()), float(lon.min())
+            height = float(lat.max()) - self.min_lat
+            width = float(lon.max()) - self.min_lon
+        else:
+            self.min_lat = self.min_lon = 0.0
+            height = width = 0.0
+
+        if cell_size is None:
+            cells = max(len(ids) / NODES_PER_CELL, 1)
+            cell_size = math.sqrt(max(height * width, 1e-12) / cells)
+            # long and thin extents would get too many cells
+            cell_size = max(cell_size, max(height, width) / cells, 1e-7)
+        self.cell_size = cell_size
+        self.n_rows = int(height / cell_size) + 1
+        self.n_cols = int(width / cell_size) + 1
+
+        cells = self._cells(lat, lon)
+        order = np.argsort(cells, kind="stable")
+        self.ids = ids[order]
+        self.lat = lat[order]
+        self.lon = lon[order]
+
+        counts = np.bincount(cells, minlength=self.n_rows * self.n_cols)
+        self.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _rows_cols(self, lat, lon):
+        rows = np.floor((lat - self.min_lat) / self.cell_size).astype(np.int64)
+        cols = np.floor((lon - self.min_lon) / self.cell_size).astype(np.int64)
+        return (np.clip(rows, 0, self.n_rows - 1),
+                np.clip(cols, 0, self.n_cols - 1))
+
+    def _cells(self, lat, lon):
+        rows, cols = self._rows_cols(lat, lon)
+        return rows * self.n_cols + cols
+
+    @classmethod
+    def build(cls, osm_file, cell_size=None):
+        """Build the index of the nodes of osm_file.
+
+        :osm_file: osm file name, possibly compressed (see osm_io.py)
+        :cell_size: see __init__
+        :returns: a GridIndex object
+
+        """
+        ids, lat, lon = array("q"), array("d"), array("d")
+        for node in osm_parser.parse(osm_file, ["node"], "compact"):
+            if node.lat is not None and node.lon is not None:
+                ids.append(node.id)
+                lat.append(node.lat)
+                lon.append(node.lon)
+
+        return cls(np.frombuffer(ids, dtype=np.int64),
+                   np.frombuffer(lat, dtype=np.float64),
+                   np.frombuffer(lon, dtype=np.float64), cell_size)
+
+    def save(self, grid_file):
+        """Write the index to grid_file (.npz)."""
+        np.savez(grid_file, ids=self.ids, lat=self.lat, lon=self.lon,
+                 offsets=self.offsets,
+                 grid=np.array([self.min_lat, self.min_lon, self.cell_size,
+                                self.n_rows, self.n_cols]))
+
+    @classmethod
+    def load(cls, grid_file):
+        """Read an index written by save."""
+        grid = cls.__new__(cls)
+        with np.load(grid_file) as data:
+            grid.ids = data["ids"]
+            grid.lat = data["lat"]
+            grid.lon = data["lon"]
+            grid.offsets = data["offsets"]
+            min_lat, min_lon, cell_size, n_rows, n_cols = data["grid"]
+        grid.min_lat, grid.min_lon = float(min_lat), float(min_lon)
+        grid.cell_size = float(cell_size)
+        grid.n_rows, grid.n_cols = int(n_rows), int(n_cols)
+        return grid
+
+    def _bbox_positions(self, min_lat, min_lon, max_lat, max_lon):
+        """Positions in the sorted arrays of the nodes within the box."""
+        if not len(self) or min_lat > max_lat or min_lon > max_lon:
+            return np.zeros(0, dtype=np.int64)
+
+        (row0, row1), (col0, col1) = self._rows_cols(
+                np.array([min_lat, max_lat]), np.array([min_lon, max_lon]))
+
+        slices = []
+        for row in range(row0, row1 + 1):
+            start = self.offsets[row * self.n_cols + col0]
+            end = self.offsets[row * self.n_cols + col1 + 1]
+            if end > start:
+                slices.append(np.arange(start, end))
+        if not slices:
+            return np.zeros(0, dtype=np.int64)
+
+        candidates = np.concatenate(slices)
+        lat, lon = self.lat[candidates], self.lon[candidates]
+        inside = ((lat >= min_lat) & (lat <= max_lat) &
+                  (lon >= min_lon) & (lon <= max_lon))
+        return candidates[inside]
+
+    def query_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Ids of the nodes within a bounding box, bounds included.
+
+        :returns: a sorted numpy array of node ids
+        """
+        positions = self._bbox_positions(min_lat, min_lon, max_lat, max_lon)
+        return np.sort(self.ids[positions])
+
+    def query_radius(self, lat, lon, radius):
+        """Nodes within radius meters of (lat, lon).
+
+        :returns: (ids, distances in meters) numpy arrays, nearest first
+        """
+        dlat = math.degrees(radius / EARTH_RADIUS)
+        dlon = dlat / max(math.cos(math.radians(lat)), 1e-12)
+        positions = self._bbox_positions(lat - dlat, lon - dlon,
+                                         lat + dlat, lon + dlon)
+
+        distances = haversine(lat, lon, self.lat[positions],
+                              self.lon[positions])
+        inside = distances <= radius
+        positions, distances = positions[inside], distances[inside]
+        order = np.argsort(distances, kind="stable")
+        return self.ids[positions[order]], distances[order]
+
+    def out_of_bounds(self):
+        """Ids of the nodes outside the bounds of position_range.
+
+        :returns: a sorted numpy array of node ids
+        """
+        mask = position_range.out_of_bounds(self.lat, self.lon)
+        return np.sort(self.ids[mask])
+
+
+def haversine(lat, lon, lats, lons):
+    """Distances in meters from (lat, lon) to the points (lats, lons)."""
+    lat, lon = math.radians(lat), math.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = (np.sin((lats - lat) / 2) ** 2 +
+         math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def grid_file_name(osm_file):
+    """Default name of the grid index of osm_file."""
+    return osm_file + ".grid.npz"
+
+
+def load_or_build(osm_file, grid_file=None, cell_size=None):
+    """Load the grid index of osm_file, or build and save it if the index
+    file does not exist or is older than osm_file.
+
+    :osm_file: osm file name
+    :grid_file: name of the index file, grid_file_name(osm_file) if None
+    :cell_size: cell size used if the index is built, see GridIndex
+    :returns: a GridIndex object
+
+    """
+    if grid_file is None:
+        grid_file = grid_file_name(osm_file)
+
+    if (os.path.exists(grid_file) and
+            os.path.getmtime(grid_file) >= os.path.getmtime(osm_file)):
+        return GridIndex.load(grid_file)
+
+    grid = GridIndex.build(osm_file, cell_size)
+    grid.save(grid_file)
+    return grid
+
+
+def extract_bbox(osm_file, out_file, bbox, complete=False, grid=None):
+    """Write the nodes of osm_file within bbox, and the ways using at least
+    one of them, to out_file. Relations are not extracted.
+
+    :osm_file: name of an uncompressed osm file
+    :out_file: file to write, compressed according to its extension
+    :bbox: (min_lat, min_lon, max_lat, max_lon)
+    :complete: also write the nodes outside bbox used by the written ways
+    :grid: GridIndex of osm_file, loaded or built if None
+    :returns: number of elements written
+
+    """
+    if grid is None:
+        grid = load_or_build(osm_file)
+    index = osm_index.load_or_build(osm_file)
+
+    node_ids = set(grid.query_bbox(*bbox).tolist())
+    positions = []
+    for node_id in sorted(node_ids):
+        i = index.find("node", node_id)
+        if i is not None:
+            positions.append(i)
+
+    with open(osm_file, "rb") as f:
+        for i in index.positions("way"):
+            refs = sample_osm_file.ND_REF_RE.findall(index.read(f, i))
+            if any(int(ref) in node_ids for ref in refs):
+                positions.append(i)
+
+        positions.sort()
+        if complete:
+            positions = sample_osm_file.add_way_nodes(index, f, positions)
+        sample_osm_file.write_sample(out_file,
+                                     (index.read(f, i) for i in positions))
+    return len(positions)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+            description="Grid index of the node positions of an osm file.")
+    parser.add_argument("--cell-size", type=float,
+            help="cell size in degrees when building the index")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("build", help="build and save the index")
+    command.add_argument("osm_file")
+
+    command = commands.add_parser("bbox", help="nodes within a box")
+    command.add_argument("osm_file")
+    command.add_argument("bbox", nargs=4, type=float,
+            metavar=("MIN_LAT", "MIN_LON", "MAX_LAT", "MAX_LON"))
+
+    command = commands.add_parser("radius", help="nodes around a point")
+    command.add_argument("osm_file")
+    command.add_argument("lat", type=float)
+    command.add_argument("lon", type=float)
+    command.add_argument("meters", type=float)
+
+    command = commands.add_parser("validate",
+            help="nodes outside the bounds of position_range.py")
+    command.add_argument("osm_file")
+
+    command = commands.add_parser("extract",
+            help="write the nodes within a box and their ways to a file")
+    command.add_argument("osm_file")
+    command.add_argument("out_file")
+    command.add_argument("bbox", nargs=4, type=float,
+            metavar=("MIN_LAT", "MIN_LON", "MAX_LAT", "MAX_LON"))
+    command.add_argument("--complete", action="store_true",
+            help="add the nodes of the extracted ways outside the box")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        grid = GridIndex.build(args.osm_file, args.cell_size)
+        grid.save(grid_file_name(args.osm_file))
+        print("{} nodes, {} x {} cells of {:.5f} degrees".format(
+            len(grid), grid.n_rows, grid.n_cols, grid.cell_size))
+    else:
+        grid = load_or_build(args.osm_file, cell_size=args.cell_size)
+        if args.command == "bbox":
+            for node_id in grid.query_bbox(*args.bbox):
+                print(node_id)
+        elif args.command == "radius":
+            for node_id, distance in zip(*grid.query_radius(
+                    args.lat, args.lon, args.meters)):
+                print("{}\t{:.1f}".format(node_id, distance))
+        elif args.command == "validate":
+            ids = grid.out_of_bounds()
+            print("{} of {} nodes out of bounds".format(len(ids), len(grid)))
+            for node_id in ids:
+                print(node_id)
+        else:
+            n = extract_bbox(args.osm_file, args.out_file, args.bbox,
+                             args.complete, grid)
+            print("{} elements written".format(n))
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: special_cases.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Index of the special case rules used by clean_utils.process_special_cases.
+
+A rule replaces a "tag" with k="k" and v="v" by a list of (k, v) tags,
+either for every element or only for the element with a given id. Rules
+are stored in two levels:
+    - rules for any element: {k: {v: tags}}
+    - rules for one element: {id: {k: {v: tags}}}
+so a tag whose "k" has no rule costs a single dict lookup, and the id
+specific rules are only looked at for the few elements that have some.
+
+Rules can be loaded from a json file with a list of objects like
+    {"k": "addr:postcode", "v": "TX", "id": "230238099",
+     "tags": [["addr:postcode", "75226"]]}
+where "id" is optional. A rule defined twice is an error.
+
+Usage:
+    python special_cases.py rules.json    # write the built-in rules
+"""
+import json
+
+
+class SpecialCaseRules(object):
+    """Special case rules indexed by element id, "k" and "v"."""
+
+    def __init__(self):
+        self.by_kv = {}
+        self.by_id = {}
+
+    def __len__(self):
+        return (sum(len(values) for values in self.by_kv.values()) +
+                sum(len(values) for rules in self.by_id.values()
+                    for values in rules.values()))
+
+    def add(self, k, v, element_id, tags):
+        """Add a rule.
+
+        :k, v: "k" and "v" values of the tag to replace
+        :element_id: id of the element the rule is limited to, or None
+        :tags: list of (k, v) pairs replacing the tag
+        :raises ValueError: if the rule is already defined
+
+        """
+        if element_id is None:
+            rules = self.by_kv
+        else:
+            rules = self.by_id.setdefault(str(element_id), {})
+
+        values = rules.setdefault(k, {})
+        if v in values:
+            raise ValueError("Duplicate special case: k={!r} v={!r} id={!r}"
+                             .format(k, v, element_id))
+        values[v] = [tuple(tag) for tag in tags]
+
+    def rules_for(self, element_id):
+        """Rules limited to the element with element_id, or None."""
+        return self.by_id.get(element_id)
+
+    def lookup(self, k, v, id_rules=None):
+        """Find the tags replacing the tag k="k" v="v".
+        Rules for any element take precedence over id specific ones.
+
+        :k, v: "k" and "v" values of the tag
+        :id_rules: result of rules_for for the element owning the tag
+        :returns: list of (k, v) pairs, or None if no rule applies
+
+        """
+        values = self.by_kv.get(k)
+        if values is not None:
+            tags = values.get(v)
+            if tags is not None:
+                return tags
+
+        if id_rules is not None:
+            values = id_rules.get(k)
+            if values is not None:
+                return values.get(v)
+        return None
+
+    def items(self):
+        """Yield ((k, v, element_id), tags) for all rules."""
+        for k, values in self.by_kv.items():
+            for v, tags in values.items():
+                yield (k, v, None), tags
+        for element_id, rules in self.by_id.items():
+            for k, values in rules.items():
+                for v, tags in values.items():
+                    yield (k, v, element_id), tags
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """Build rules from a dict like clean_utils.special_case_mapping,
+        with (k, v, element id or None) as key and a list of tags as value.
+        """
+        rules = cls()
+        for (k, v, element_id), tags in mapping.items():
+            rules.add(k, v, element_id, tags)
+        return rules
+
+    @classmethod
+    def load(cls, rule_file):
+        """Load rules from a json file, see the module description.
+
+        :rule_file: name of the json file
+        :returns: a SpecialCaseRules object
+        :raises ValueError: if a rule is defined twice
+
+        """
+        with open(rule_file, encoding="utf-8") as f:
+            entries = json.load(f)
+
+        rules = cls()
+        for i, entry in enumerate(entries):
+            try:
+                rules.add(entry["k"], entry["v"], entry.get("id"),
+                          entry["tags"])
+            except ValueError as e:
+                raise ValueError("{}, entry {}: {}".format(rule_file, i, e))
+        return rules
+
+    def save(self, rule_file):
+        """Write the rules to a json file readable by load."""
+        entries = []
+        for (k, v, element_id), tags in self.items():
+            entry = {"k": k, "v": v}
+            if element_id is not None:
+                entry["id"] = element_id
+            entry["tags"] = [list(tag) for tag in tags]
+            entries.append(entry)
+
+        with open(rule_file, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=2)
+
+
+if __name__ == "__main__":
+    import sys
+    import clean_utils
+    clean_utils.SPECIAL_CASE_RULES.save(sys.argv[1])
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: stage_cache.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Cache of the outputs of the processing stages (clean_osm.py,
+osm_to_json.py, audit_osm.py), so a stage run again on the same input with
+the same rules and options is skipped and its stored outputs are reused.
+
+A stage run is identified by a key hashing:
+    - the stage name and its options
+    - the fingerprint of each input file: size, modification time and a
+      hash of SAMPLES blocks spread over the file (or of the whole file if
+      it is small, or if full hashing is asked for)
+    - the version of the rule tables (rules_version): special case rules,
+      TYPE_MAPPING, DIRECTION_EXCEPTIONS and the sources of the cleaning
+      regexes
+    - the version of the code of the stage (code_version): a hash of the
+      source of its modules, including the osm readers they all use
+      (reader_modules)
+
+Each entry of the cache is a directory named after the key, holding
+copies of the output files and the pickled result of the stage. Entries
+are written to a temporary directory and renamed, so concurrent writers
+never see partial entries. Using an entry updates its modification time;
+once the cache is larger than max_bytes, the least recently used entries
+are removed.
+
+Usage:
+    python stage_cache.py .stage_cache              # list the entries
+    python stage_cache.py .stage_cache --max-mb 500 # evict down to 500MB
+    python stage_cache.py .stage_cache --clear
+"""
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+
+# blocks hashed by input_fingerprint, and their size
+SAMPLES = 16
+SAMPLE_SIZE = 64 * 1024
+
+# default size limit of the cache directory
+MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+RESULT_FILE = "result.pickle"
+
+
+def _hash_file(f, h, start, end):
+    f.seek(start)
+    while start < end:
+        data = f.read(min(SAMPLE_SIZE, end - start))
+        if not data:
+            break
+        h.update(data)
+        start += len(data)
+
+
+def input_fingerprint(path, full=False):
+    """Fingerprint of an input file.
+
+    :path: file name
+    :full: hash the whole content instead of SAMPLES blocks
+    :returns: a dict with "size", "mtime" (in ns) and "hash"
+
+    """
+    stat = os.stat(path)
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        if full or stat.st_size <= SAMPLES * SAMPLE_SIZE:
+            _hash_file(f, h, 0, stat.st_size)
+        else:
+            step = (stat.st_size - SAMPLE_SIZE) // (SAMPLES - 1)
+            for i in range(SAMPLES):
+                _hash_file(f, h, i * step, i * step + SAMPLE_SIZE)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns,
+            "hash": h.hexdigest()}
+
+
+def rules_version(rules=None):
+    """Hash of the rule tables used to clean street names and postcodes.
+
+    :rules: special_cases.SpecialCaseRules object, the built-in rules if None
+    :returns: a hex string
+
+    """
+    import clean_utils
+
+    if rules is None:
+        rules = clean_utils.SPECIAL_CASE_RULES
+
+    def pattern(regex):
+        return [regex.pattern, regex.flags]
+
+    tables = [
+            sorted(repr(rule) for rule in rules.items()),
+            sorted(clean_utils.TYPE_MAPPING.items()),
+            clean_utils.DIRECTION_EXCEPTIONS,
+            pattern(clean_utils.TYPE_RE),
+            pattern(clean_utils.SUITE_RE),
+            pattern(clean_utils.POSTCODE_RE),
+            sorted((key, pattern(regex)) for key, regex in
+                   clean_utils.DIRECTION_RE.items()),
+            sorted((key, pattern(regex)) for key, regex in
+                   clean_utils.NUMBERED_ROAD_RE.items()),
+            ]
+    return hashlib.sha1(json.dumps(tables).encode("utf-8")).hexdigest()
+
+
+def code_version(*modules):
+    """Hash of the source files of modules."""
+    h = hashlib.sha1()
+    for module in modules:
+        with open(module.__file__, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def reader_modules():
+    """Modules reading and parsing osm files, used by every stage; to be
+    passed to code_version along with the modules of the stage."""
+    import osm_chunks
+    import osm_io
+    import osm_parser
+    import osm_record
+
+    return [osm_io, osm_parser, osm_record, osm_chunks]
+
+
+def make_key(stage, inputs=(), options=None, versions=(), full=False):
+    """Key of a stage run.
+
+    :stage: name of the stage
+    :inputs: input file names
+    :options: json serializable options of the stage
+    :versions: strings from rules_version, code_version...
+    :full: hash the whole inputs, see input_fingerprint
+    :returns: a hex string
+
+    """
+    description = {"stage": stage,
+                   "inputs": [input_fingerprint(path, full) for path in inputs],
+                   "options": options,
+                   "versions": list(versions)}
+    data = json.dumps(description, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+def _dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+class StageCache(object):
+    """Directory of cached stage outputs, see the module description."""
+
+    def __init__(self, cache_dir, max_bytes=MAX_BYTES):
+        """
+        :cache_dir: cache directory, created if needed
+        :max_bytes: size limit enforced by evict
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key, outputs=()):
+        """Copy the stored outputs of key to the output files.
+
+        :key: key from make_key
+        :outputs: output file names, in the order given to store
+        :returns: (True, stored result) on a hit, (False, None) on a miss
+
+        """
+        entry = self.entry_dir(key)
+        try:
+            with open(os.path.join(entry, RESULT_FILE), "rb") as f:
+                result = pickle.load(f)
+            for i, output in enumerate(outputs):
+                shutil.copyfile(os.path.join(entry, str(i)), output)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # missing entry, or evicted while being read
+            return False, None
+
+        os.utime(entry)
+        return True, result
+
+    def store(self, key, outputs=(), result=None, evict=True):
+        """Store copies of the output files and the result under key.
+
+        :evict: remove the least recently used entries afterwards, if the
+                cache is over its limit
+        """
+        tmp = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            for i, output in enumerate(outputs):
+                shutil.copyfile(output, os.path.join(tmp, str(i)))
+            with open(os.path.join(tmp, RESULT_FILE), "wb") as f:
+                pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self.entry_dir(key))
+        except OSError:
+            # an other process stored the same key first
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(self.entry_dir(key)):
+                raise
+
+        if evict:
+            self.evict()
+
+    def entries(self):
+        """List (last use time, size, key) of the entries, oldest first."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(".tmp-") or not os.path.isdir(path):
+                continue
+            try:
+                used = os.path.getmtime(path)
+            except OSError:
+                continue
+            entries.append((used, _dir_size(path), name))
+        entries.sort()
+        return entries
+
+    def evict(self, max_bytes=None):
+        """Remove the least recently used entries until the cache is not
+        larger than max_bytes (self.max_bytes if None).
+
+        :returns: number of entries removed
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, key in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def run(self, key, func, outputs=()):
+        """Call func() unless key is cached, and cache its outputs.
+
+        :func: function writing the output files and returning a picklable
+               result
+        :returns: (result, True if it was reused from the cache)
+
+        """
+        hit, result = self.load(key, outputs)
+        if hit:
+            return result, True
+        result = func()
+        self.store(key, outputs, result)
+        return result, False
+
+
+def cached_chunk(osm_file, start, end, cache_dir, version, func, *args):
+    """Call func(osm_file, start, end, *args) unless the result is cached for
+    the same bytes of osm_file. Used to reuse the unchanged byte ranges of
+    a parallel run (see osm_chunks.map_chunks); eviction is left to the
+    parent process.
+
+    :osm_file, start, end: byte range, as passed by osm_chunks.map_chunks
+    :cache_dir: directory of a StageCache
+    :version: key of the stage run, without its inputs
+    :returns: the result of func
+
+    """
+    with open(osm_file, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    key = hashlib.sha1(version.encode("ascii") + data).hexdigest()
+
+    cache = StageCache(cache_dir)
+    hit, result = cache.load(key)
+    if not hit:
+        result = func(osm_file, start, end, *args)
+        cache.store(key, result=result, evict=False)
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage a stage cache.")
+    parser.add_argument("cache_dir")
+    parser.add_argument("--max-mb", type=float,
+            help="remove least recently used entries down to this size")
+    parser.add_argument("--clear", action="store_true",
+            help="remove all entries")
+    args = parser.parse_args()
+
+    cache = StageCache(args.cache_dir)
+    if args.clear:
+        print("{} entries removed".format(cache.evict(0)))
+    elif args.max_mb is not None:
+        print("{} entries removed".format(
+            cache.evict(int(args.max_mb * 1024 * 1024))))
+    else:
+        total = 0
+        for used, size, key in cache.entries():
+            print("{} {} {:10d}".format(key, time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(used)), size))
+            total += size
+        print("total: {:.1f} MB".format(total / 1024 / 1024), file=sys.stderr)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File: synthetic_osm.py
+Author: Yang Yang
+Email: yyangbian@gmail.com
+Github: yyangbian
+Description:
+Generate deterministic synthetic osm files for benchmarks, looking like the
+Dallas extract the cleaning rules were written for:
+    - nodes with increasing ids, positions within the bounds of
+      position_range.py (a few of them out of bounds), a fraction of them
+      tagged
+    - ways of consecutive node references, tagged as highways (named after
+      a street) or buildings
+    - relations of ways and nodes
+Tags are drawn from TAGS, with keys containing ":" and problem characters
+like the ones osm_to_json.py looks for. Addresses are dirty the way the
+real data is: abbreviated street types (TYPE_RE), directions (DIRECTION_RE),
+suites (SUITE_RE), numbered roads (NUMBERED_ROAD_RE), postcodes with the
+state or city (POSTCODE_RE), and tags matching the special case rules of
+clean_utils.py, including nodes with the ids of the id specific rules.
+
+The same arguments always give the same file.
+
+Usage:
+    python synthetic_osm.py synthetic.osm --nodes 100000
+    python synthetic_osm.py synthetic.osm.bz2 --nodes 1000000 --seed 1
+"""
+import random
+from xml.sax.saxutils import quoteattr
+
+import clean_utils
+import osm_io
+import position_range
+
+# ways get ids from WAY_ID_BASE + 1, relations from RELATION_ID_BASE + 1
+WAY_ID_BASE = 10 ** 9
+RELATION_ID_BASE = 10 ** 7
+
+# fraction of tagged nodes, of addresses among tagged elements, of
+# addresses written as a special case, and of positions out of bounds
+TAG_RATE = 0.2
+ADDRESS_RATE = 0.3
+SPECIAL_RATE = 0.02
+OUT_OF_BOUNDS_RATE = 0.001
+
+# elements written at once
+WRITE_BLOCK = 10000
+
+TIMESTAMP = "2013-08-03T16:43:42Z"
+
+# (weight, k, possible values) of the tags of tagged nodes
+TAGS = [
+        (30, "amenity", ["restaurant", "fast_food", "school", "place_of_worship",
+                         "parking", "fuel", "bank"]),
+        (20, "name", ["Taco Cabana", "Whataburger", "First Baptist Church",
+                      "Kroger", "Dallas Love Field", "Tom Thumb"]),
+        (15, "highway", ["traffic_signals", "stop", "crossing",
+                         "turning_circle"]),
+        (10, "shop", ["supermarket", "convenience", "clothes"]),
+        (8, "gnis:feature_id", ["1378935", "1380246", "1386433"]),
+        (6, "tiger:county", ["Dallas, TX", "Tarrant, TX", "Collin, TX"]),
+        (4, "name:en", ["Dallas", "Fort Worth", "Arlington"]),
+        (3, "fuel:diesel", ["yes", "no"]),
+        (2, "phone", ["+1 214 555 0100", "(972) 555-0199"]),
+        (1, "note:a b", ["bad key"]),
+        (1, "fixme?", ["check position"]),
+        ]
+
+STREET_NAMES = ["Main", "Elm", "Commerce", "Preston", "Abrams", "Greenville",
+                "Beckley", "Lancaster", "Belt Line", "Jupiter", "Park Row",
+                "Campbell", "Coit", "Forest", "Royal"]
+
+# street types, abbreviated as in TYPE_MAPPING or not
+STREET_TYPES = ["Street", "St", "St.", "st", "Avenue", "Ave", "Ave.", "AV",
+                "Boulevard", "Blvd", "Blvd.", "Drive", "Dr", "Dr.", "Court",
+                "Ct", "Road", "Rd", "Rd.", "Lane", "Ln", "Trail", "Trl",
+                "Parkway", "Circle", "Cir", "Freeway", "Fwy", "Highway",
+                "Hwy", "Plaza", "Plz", "Place", "Pl"]
+
+DIRECTIONS = ["N", "N.", "North", "S", "S.", "E", "W.", "West", "NW", "NE",
+              "SW", "SE", "Southeast"]
+
+SUITES = [" Ste 100", ", Suite 210", " # 5", " suite 12", " STE 300"]
+
+NUMBERED_ROADS = ["CR 120", "County Road 234", "F.M. 1171", "FM 407",
+                  "Farm to Market Road 2499", "Farm-to-Market Rd. 423",
+                  "State Hwy 121", "SH 121", "Highway 121", "Interstate 30",
+                  "I-35E", "Interstate Highway 20", "I 30 Service Road"]
+
+POSTCODES = ["75201", "75204", "75219", "75240", "76102", "75044",
+             "75201-1234", "TX 75201", "TX75219", "Dallas, TX 75204",
+             "Grand Prairie, TX 75052-8514", "7520", "752011"]
+
+CITIES = ["Dallas", "Fort Worth", "Arlington", "Plano", "Irving", "Garland"]
+
+# (k, v, element id) of the special case rules
+SPECIAL_CASES = sorted(clean_utils.special_case_mapping, key=repr)
+GENERAL_SPECIAL_CASES = [(k, v) for k, v, element_id in SPECIAL_CASES
+                         if element_id is None]
+ID_SPECIAL_CASES = sorted((int(element_id), k, v)
+                          for k, v, element_id in SPECIAL_CASES
+                          if element_id is not None)
+
+
+def street_name(rng):
+    """A street name, dirty in the ways clean_utils.py cleans."""
+    if rng.random() < 0.15:
+        name = rng.choice(NUMBERED_ROADS)
+    else:
+        name = "{} {}".format(rng.choice(STREET_NAMES),
+                              rng.choice(STREET_TYPES))
+        if rng.random() < 0.3:
+            name = "{} {}".format(rng.choice(DIRECTIONS), name)
+    if rng.random() < 0.05:
+        name += rng.choice(SUITES)
+    return name
+
+
+def address_tags(rng, special_rate=SPECIAL_RATE):
+    """List of (k, v) tags of an address."""
+    if rng.random() < special_rate:
+        return [rng.choice(GENERAL_SPECIAL_CASES)]
+
+    tags = [("addr:housenumber", str(rng.randint(1, 9999))),
+            ("addr:street", street_name(rng))]
+    if rng.random() < 0.7:
+        tags.append(("addr:postcode", rng.choice(POSTCODES)))
+    if rng.random() < 0.5:
+        tags.append(("addr:city", rng.choice(CITIES)))
+    return tags
+
+
+def node_tags(rng, tag_weights, address_rate=ADDRESS_RATE,
+        special_rate=SPECIAL_RATE):
+    """List of (k, v) tags of a tagged node."""
+    tags = []
+    keys = set()
+    for _ in range(rng.randint(1, 3)):
+        _, k, values = rng.choices(TAGS, tag_weights)[0]
+        if k not in keys:
+            keys.add(k)
+            tags.append((k, rng.choice(values)))
+    if rng.random() < address_rate:
+        tags.extend(address_tags(rng, special_rate))
+    return tags
+
+
+def position(rng, out_of_bounds_rate=OUT_OF_BOUNDS_RATE):
+    """(lat, lon) within the bounds of position_range.py, or just outside
+    of them with probability out_of_bounds_rate."""
+    if rng.random() < out_of_bounds_rate:
+        return (rng.uniform(position_range.MAX_LAT, position_range.MAX_LAT + 1),
+                rng.uniform(position_range.MIN_LON - 1, position_range.MIN_LON))
+    return (rng.uniform(position_range.MIN_LAT, position_range.MAX_LAT),
+            rng.uniform(position_range.MIN_LON, position_range.MAX_LON))
+
+
+def element_start(tag, element_id, rng, extra=""):
+    return ' <{} id="{}" version="{}" changeset="{}" timestamp="{}" ' \
+           'user="user{}" uid="{}"{}'.format(
+                   tag, element_id, rng.randint(1, 5),
+                   rng.randint(1000000, 40000000), TIMESTAMP,
+                   element_id % 97, element_id % 97, extra)
+
+
+def write_tags(parts, tags):
+    for k, v in tags:
+        parts.append('  <tag k={} v={}/>\n'.format(quoteattr(k), quoteattr(v)))
+
+
+def write_node(parts, rng, node_id, tags):
+    lat, lon = position(rng)
+    start = element_start("node", node_id, rng,
+                          ' lat="{:.7f}" lon="{:.7f}"'.format(lat, lon))
+    if tags:
+        parts.append(start + '>\n')
+        write_tags(parts, tags)
+        parts.append(' </node>\n')
+    else:
+        parts.append(start + '/>\n')
+
+
+def write_synthetic_osm(path, n_nodes, n_ways=None, n_relations=None, seed=0,
+        tag_rate=TAG_RATE, address_rate=ADDRESS_RATE,
+        special_rate=SPECIAL_RATE):
+    """Write a synthetic osm file.
+
+    :path: file name, compressed according to its extension (see osm_io.py)
+    :n_nodes: number of nodes with ids 1 to n_nodes; the nodes of the id
+              specific special cases are added if special_rate > 0
+    :n_ways: number of ways, n_nodes / 10 if None
+    :n_relations: number of relations, n_ways / 100 if None
+    :seed: seed of the random generator
+    :tag_rate: fraction of tagged nodes
+    :address_rate: fraction of tagged elements with an address
+    :special_rate: fraction of addresses matching a special case rule
+    :returns: a dict with the number of "node", "way" and "relation"
+
+    """
+    if n_ways is None:
+        n_ways = n_nodes // 10
+    if n_relations is None:
+        n_relations = n_ways // 100
+    rng = random.Random(seed)
+    tag_weights = [weight for weight, _, _ in TAGS]
+    counts = {"node": 0, "way": 0, "relation": 0}
+    parts = []
+
+    with osm_io.open_output(path) as f:
+        def flush():
+            f.write("".join(parts).encode("utf-8"))
+            del parts[:]
+
+        parts.append('<?xml version="1.0" encoding="UTF-8"?>\n'
+                     '<osm version="0.6" generator="synthetic_osm.py">\n')
+        parts.append(' <bounds minlat="{}" minlon="{}" maxlat="{}" '
+                     'maxlon="{}"/>\n'.format(
+                         position_range.MIN_LAT, position_range.MIN_LON,
+                         position_range.MAX_LAT, position_range.MAX_LON))
+
+        for node_id in range(1, n_nodes + 1):
+            tags = None
+            if rng.random() < tag_rate:
+                tags = node_tags(rng, tag_weights, address_rate, special_rate)
+            write_node(parts, rng, node_id, tags)
+            counts["node"] += 1
+            if len(parts) >= WRITE_BLOCK:
+                flush()
+
+        if special_rate > 0:
+            for node_id, k, v in ID_SPECIAL_CASES:
+                if node_id > n_nodes:
+                    write_node(parts, rng, node_id, [(k, v)])
+                    counts["node"] += 1
+
+        for way_id in range(WAY_ID_BASE + 1, WAY_ID_BASE + n_ways + 1):
+            parts.append(element_start("way", way_id, rng) + '>\n')
+            if n_nodes:
+                first = rng.randint(1, n_nodes)
+                for ref in range(first, min(first + rng.randint(2, 12),
+                                            n_nodes + 1)):
+                    parts.append('  <nd ref="{}"/>\n'.format(ref))
+            if rng.random() < 0.6:
+                tags = [("highway", rng.choice(["residential", "primary",
+                                                "service", "motorway"])),
+                        ("name", street_name(rng))]
+            else:
+                tags = [("building", "yes")]
+                if rng.random() < address_rate:
+                    tags.extend(address_tags(rng, special_rate))
+            write_tags(parts, tags)
+            parts.append(' </way>\n')
+            counts["way"] += 1
+            if len(parts) >= WRITE_BLOCK:
+                flush()
+
+        for relation_id in range(RELATION_ID_BASE + 1,
+                                 RELATION_ID_BASE + n_relations + 1):
+            parts.append(element_start("relation", relation_id, rng) + '>\n')
+            for _ in range(rng.randint(1, 5)):
+                if n_ways and rng.random() < 0.8:
+                    member = ("way", WAY_ID_BASE + rng.randint(1, n_ways))
+                elif n_nodes:
+                    member = ("node", rng.randint(1, n_nodes))
+                else:
+                    continue
+                parts.append('  <member type="{}" ref="{}" role=""/>\n'
+                             .format(*member))
+            write_tags(parts, [("type", rng.choice(["multipolygon", "route"]))])
+            parts.append(' </relation>\n')
+            counts["relation"] += 1
+
+        parts.append('</osm>\n')
+        flush()
+
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+            description="Write a synthetic osm file.")
+    parser.add_argument("osm_file")
+    parser.add_argument("--nodes", type=int, default=100000)
+    parser.add_argument("--ways", type=int,
+            help="number of ways (default: nodes / 10)")
+    parser.add_argument("--relations", type=int,
+            help="number of relations (default: ways / 100)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tag-rate", type=float, default=TAG_RATE)
+    parser.add_argument("--address-rate", type=float, default=ADDRESS_RATE)
+    parser.add_argument("--special-rate", type=float, default=SPECIAL_RATE)
+    args = parser.parse_args()
+
+    counts = write_synthetic_osm(args.osm_file, args.nodes, args.ways,
+            args.relations, args.seed, args.tag_rate, args.address_rate,
+            args.special_rate)
+    for tag in ("node", "way", "relation"):
+        print("{}: {}".format(tag, counts[tag]))
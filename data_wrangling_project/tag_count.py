@@ -7,19 +7,34 @@ Email: yyangbian@gmail.com
 Github: yyangbian
 Description: Count different types of tags in the xml file
 """
-import xml.etree.cElementTree as ET
 import pprint
 
+import audit_engine
+import osm_parser
+
+
+@audit_engine.register("tags")
+class TagCountAudit(audit_engine.Audit):
+    """Count every element in the file by tag."""
+
+    TAGS = None
+
+    def __init__(self):
+        self.counts = {}
+
+    def visit(self, elem):
+        for tag, count in osm_parser.child_counts(elem):
+            if tag not in self.counts:
+                self.counts[tag] = count
+            else:
+                self.counts[tag] += count
+
+    def result(self):
+        return self.counts
+
 
 def count_tags(filename):
-    result = {}
-    for event, elem in ET.iterparse(filename):
-        if elem.tag not in result:
-            result[elem.tag] = 1
-        else:
-            result[elem.tag] += 1
-        elem.clear()
-    return result
+    return audit_engine.run_audits(filename, [TagCountAudit()])[0]
 
 
 
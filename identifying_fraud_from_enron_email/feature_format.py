@@ -31,6 +31,8 @@
 """
 
 
+from operator import itemgetter
+
 import numpy as np
 
 def featureFormat( dictionary, features, remove_NaN=True,
@@ -49,58 +51,63 @@ def featureFormat( dictionary, features, remove_NaN=True,
             removal for zero or missing values.
     """
 
-
-    return_list = []
-
     # Key order - first branch is for Python 3 compatibility on mini-projects,
     # second branch is for compatibility on final project.
     if isinstance(sort_keys, str):
         import pickle
-        keys = pickle.load(open(sort_keys, "rb"))
+        with open(sort_keys, "rb") as f:
+            keys = pickle.load(f)
     elif sort_keys:
         keys = sorted(dictionary.keys())
     else:
         keys = dictionary.keys()
 
+    # one tuple of values per data point, looked up in C by itemgetter
+    getter = itemgetter(*features)
+    if len(features) == 1:
+        getter = lambda person, getter=getter: (getter(person),)
+    try:
+        values = [getter(dictionary[key]) for key in keys]
+    except KeyError:
+        print("error: key ", _missing_feature(dictionary, keys, features),
+              " not present")
+        return
+    if not values:
+        return np.array([])
+
+    # only the "NaN" string is replaced, other values go through float()
+    data = np.array(values, dtype=object)
+    if remove_NaN:
+        data[data == "NaN"] = 0
+    data = data.astype(np.float64)
+
+    # Logic for deciding whether or not to keep the data points.
+    # exclude 'poi' class as criteria.
+    if features[0] == 'poi':
+        test_data = data[:, 1:]
+    else:
+        test_data = data
+    keep = np.ones(len(data), dtype=bool)
+    ### remove data points for which all features are zero (a NaN left
+    ### by remove_NaN = False counts as non-zero)
+    if remove_all_zeroes:
+        keep &= (test_data != 0).any(axis=1)
+    ### remove data points for which any feature is zero
+    if remove_any_zeroes:
+        keep &= ~(test_data == 0).any(axis=1)
+
+    if not keep.any():
+        return np.array([])
+    return data[keep]
+
+
+def _missing_feature(dictionary, keys, features):
+    """ first feature, in key order, missing from a data point """
     for key in keys:
-        tmp_list = []
+        person = dictionary.get(key, {})
         for feature in features:
-            try:
-                dictionary[key][feature]
-            except KeyError:
-                print("error: key ", feature, " not present")
-                return
-            value = dictionary[key][feature]
-            if value=="NaN" and remove_NaN:
-                value = 0
-            tmp_list.append( float(value) )
-
-        # Logic for deciding whether or not to add the data point.
-        append = True
-        # exclude 'poi' class as criteria.
-        if features[0] == 'poi':
-            test_list = tmp_list[1:]
-        else:
-            test_list = tmp_list
-        ### if all features are zero and you want to remove
-        ### data points that are all zero, do that here
-        if remove_all_zeroes:
-            append = False
-            for item in test_list:
-                if item != 0 and item != "NaN":
-                    append = True
-                    break
-        ### if any features for a given data point are zero
-        ### and you want to remove data points with any zeroes,
-        ### handle that here
-        if remove_any_zeroes:
-            if 0 in test_list or "NaN" in test_list:
-                append = False
-        ### Append the data point if flagged for addition.
-        if append:
-            return_list.append( np.array(tmp_list) )
-
-    return np.array(return_list)
+            if feature not in person:
+                return feature
 
 
 def targetFeatureSplit( data ):
@@ -125,5 +132,36 @@ def targetFeatureSplit( data ):
     return target, features
 
 
+def targetFeatureSplitViews( data, features=None, target=None ):
+    """
+        same as targetFeatureSplit, but returns numpy arrays sharing
+        the memory of data instead of lists: data[:, 0] and data[:, 1:]
+
+        features = the feature list data was built with by featureFormat
+        target = name of the feature to predict, the first feature if
+            None; selecting it by name needs features. Only a first or
+            last target column gives views, any other column makes a
+            copy of the remaining features.
 
+        return targets (1-d) and features (2-d) arrays
+    """
 
+    data = np.asarray(data)
+    column = 0
+    if target is not None:
+        if features is None:
+            raise ValueError("features are needed to select the target "
+                             "by name")
+        column = list(features).index(target)
+
+    if data.ndim == 1:
+        ### featureFormat returns a 1-d empty array when no data point
+        ### is kept
+        width = len(features) if features is not None else column + 1
+        data = data.reshape(0, width)
+
+    if column == 0:
+        return data[:, 0], data[:, 1:]
+    if column == data.shape[1] - 1:
+        return data[:, column], data[:, :column]
+    return data[:, column], np.delete(data, column, axis=1)
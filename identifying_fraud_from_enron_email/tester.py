@@ -12,66 +12,243 @@
 
 import pickle
 import sys
+import time
+from itertools import islice
+
+import numpy as np
 from sklearn.metrics import precision_score
 from sklearn.metrics import recall_score
+from sklearn.base import clone
 from sklearn.cross_validation import StratifiedShuffleSplit
-from feature_format import featureFormat, targetFeatureSplit
+try:
+    from joblib import Parallel, delayed
+except ImportError:
+    from sklearn.externals.joblib import Parallel, delayed
+from feature_format import featureFormat, targetFeatureSplitViews
 
 PERF_FORMAT_STRING = "\
 \tAccuracy: {:>0.{display_precision}f}\tPrecision: {:>0.{display_precision}f}\t\
 Recall: {:>0.{display_precision}f}\tF1: {:>0.{display_precision}f}\tF2: {:>0.{display_precision}f}"
 RESULTS_FORMAT_STRING = "\tTotal predictions: {:4d}\tTrue positives: {:4d}\tFalse positives: {:4d}\tFalse negatives: {:4d}\tTrue negatives: {:4d}"
 
-def test_classifier(clf, dataset, feature_list, folds = 1000):
+FOLDS_FORMAT_STRING = "\
+\tFolds: {:d}\tPrecision: {:>0.{display_precision}f} +/- {:>0.{display_precision}f}\t\
+Recall: {:>0.{display_precision}f} +/- {:>0.{display_precision}f}\tF1: {:>0.{display_precision}f} +/- {:>0.{display_precision}f}\t\
+F2: {:>0.{display_precision}f} +/- {:>0.{display_precision}f}"
+
+### z value of the confidence intervals of the per fold metrics (95%)
+CONFIDENCE_Z = 1.96
+
+def fold_counts(clf, features, labels, train_idx, test_idx):
+    """ fit clf on the training set of one fold and count its predictions
+        on the test set
+
+        returns (counts, unexpected, seconds) where counts is an array of
+        [true negatives, false positives, false negatives, true positives],
+        unexpected is True if a prediction was not 0 or 1 (only the
+        predictions before it are counted) and seconds is the time taken
+        to fit and predict
+    """
+    start = time.time()
+    ### fit the classifier using training set, and test on test set
+    clf.fit(features[train_idx], labels[train_idx])
+    predictions = np.asarray(clf.predict(features[test_idx]))
+    seconds = time.time() - start
+
+    truth = labels[test_idx]
+    valid = ((predictions == 0) | (predictions == 1)) & \
+            ((truth == 0) | (truth == 1))
+    unexpected = not valid.all()
+    if unexpected:
+        first = np.argmin(valid)
+        predictions, truth = predictions[:first], truth[:first]
+    ### index 2 * truth + prediction: tn, fp, fn, tp
+    counts = np.bincount((2 * truth + predictions).astype(np.intp),
+                         minlength = 4)
+    return counts, unexpected, seconds
+
+def confusion_metrics(true_negatives, false_positives, false_negatives,
+        true_positives):
+    """ accuracy, precision, recall, f1 and f2 of confusion counts (numbers
+        or arrays), as a dict of float arrays, nan where a metric is
+        undefined because of a zero division
+
+        f1 and f2 are computed from the counts, so they are 0 rather than
+        undefined when there is no true positive
+    """
+    tn, fp, fn, tp = [np.asarray(count, dtype = np.float64) for count in
+                      (true_negatives, false_positives, false_negatives,
+                       true_positives)]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        return {"accuracy": (tp + tn) / (tn + fn + fp + tp),
+                "precision": tp / (tp + fp),
+                "recall": tp / (tp + fn),
+                "f1": 2.0 * tp / (2 * tp + fp + fn),
+                "f2": (1 + 2.0 * 2.0) * tp / (5 * tp + 4 * fn + fp)}
+
+class EvaluationResult(object):
+    """ confusion counts of every fold of an evaluation, and the metrics
+        computed from them """
+
+    METRICS = ["precision", "recall", "f1", "f2"]
+
+    def __init__(self, clf, counts, fold_seconds, unexpected = 0,
+            max_folds = None):
+        """ clf = the evaluated classifier
+            counts = (folds, 4) array of [tn, fp, fn, tp] per fold
+            fold_seconds = time to fit and predict each fold
+            unexpected = number of folds with a prediction not 0 or 1
+            max_folds = folds the evaluation could have run, if it could
+                stop early
+        """
+        self.clf = clf
+        self.max_folds = max_folds
+        self.counts = counts.reshape(-1, 4)
+        self.fold_seconds = np.asarray(fold_seconds, dtype = np.float64)
+        self.unexpected = unexpected
+        (self.true_negatives, self.false_positives, self.false_negatives,
+         self.true_positives) = [int(count) for count in
+                                 self.counts.sum(axis = 0)]
+
+    @property
+    def folds(self):
+        return len(self.counts)
+
+    @property
+    def stopped_early(self):
+        return self.max_folds is not None and self.folds < self.max_folds
+
+    @property
+    def total_predictions(self):
+        return int(self.counts.sum())
+
+    def metrics(self):
+        """ metrics of the counts summed over all folds, None where
+            undefined """
+        metrics = confusion_metrics(self.true_negatives,
+                self.false_positives, self.false_negatives,
+                self.true_positives)
+        return {name: None if np.isnan(value) else float(value)
+                for name, value in metrics.items()}
+
+    def fold_metrics(self):
+        """ metrics of each fold, as arrays with nan where undefined """
+        return confusion_metrics(*self.counts.T)
+
+    def summary(self, z = CONFIDENCE_Z):
+        """ mean, standard deviation and confidence interval of each metric
+            over the folds where it is defined
+
+            returns {metric: {"mean", "std", "ci", "folds"}}, "ci" being a
+            (low, high) tuple; values are nan if the metric is defined for
+            less than two folds
+        """
+        summary = {}
+        fold_metrics = self.fold_metrics()
+        for name in ["accuracy"] + self.METRICS:
+            values = fold_metrics[name]
+            values = values[~np.isnan(values)]
+            mean = std = half_width = float("nan")
+            if len(values) > 1:
+                mean = float(values.mean())
+                std = float(values.std(ddof = 1))
+                half_width = z * std / len(values) ** 0.5
+            summary[name] = {"mean": mean, "std": std,
+                             "ci": (mean - half_width, mean + half_width),
+                             "folds": len(values)}
+        return summary
+
+    def report(self):
+        """ print the results like the course tester does, followed by the
+            per fold confidence intervals """
+        metrics = self.metrics()
+        if None in metrics.values():
+            print("Got a divide by zero when trying out:", self.clf)
+            return
+        summary = self.summary()
+        intervals = []
+        for name in self.METRICS:
+            low, high = summary[name]["ci"]
+            intervals += [summary[name]["mean"], (high - low) / 2]
+        print(self.clf)
+        print(PERF_FORMAT_STRING.format(metrics["accuracy"],
+            metrics["precision"], metrics["recall"], metrics["f1"],
+            metrics["f2"], display_precision = 5))
+        print(RESULTS_FORMAT_STRING.format(self.total_predictions,
+            self.true_positives, self.false_positives, self.false_negatives,
+            self.true_negatives))
+        print(FOLDS_FORMAT_STRING.format(self.folds, *intervals,
+            display_precision = 5))
+        if self.stopped_early:
+            print("\tStopped after {:d} of {:d} folds".format(self.folds,
+                                                             self.max_folds))
+        print("")
+
+def run_folds(clf, features, labels, splits, n_jobs = 1):
+    """ fold_counts of every (train_idx, test_idx) in splits, in order """
+    if n_jobs == 1:
+        return [fold_counts(clf, features, labels, train_idx, test_idx)
+                for train_idx, test_idx in splits]
+    return Parallel(n_jobs = n_jobs)(
+            delayed(fold_counts)(clone(clf), features, labels,
+                                 train_idx, test_idx)
+            for train_idx, test_idx in splits)
+
+def converged(result, tolerance, metrics = ("precision", "recall")):
+    """ True if the confidence intervals of metrics are all narrower than
+        tolerance """
+    summary = result.summary()
+    for name in metrics:
+        low, high = summary[name]["ci"]
+        if not high - low < tolerance:
+            return False
+    return True
+
+def evaluation_result(clf, results, max_folds = None):
+    """ EvaluationResult of a list of fold_counts results """
+    return EvaluationResult(clf,
+            np.array([counts for counts, _, _ in results]),
+            [seconds for _, _, seconds in results],
+            sum(unexpected for _, unexpected, _ in results), max_folds)
+
+def test_classifier(clf, dataset, feature_list, folds = 1000, n_jobs = 1,
+        tolerance = None, min_folds = 100, batch_size = 100):
+    """ n_jobs > 1 (or -1 for all cpus) evaluates the folds in parallel,
+        each on a clone of clf, giving the same counts as n_jobs = 1
+
+        with a tolerance, the folds are evaluated batch_size at a time and
+        the evaluation stops once at least min_folds folds are done and
+        the confidence intervals of precision and recall are narrower
+        than tolerance; folds is then the maximum number of folds. The
+        folds come from the same seeded split, so a run stopped after n
+        folds counts the first n folds of the full run.
+
+        prints the results and returns them as an EvaluationResult
+    """
     data = featureFormat(dataset, feature_list, sort_keys = True)
-    labels, features = targetFeatureSplit(data)
+    labels, features = targetFeatureSplitViews(data, feature_list)
     cv = StratifiedShuffleSplit(labels, folds, random_state = 42)
-    true_negatives = 0
-    false_negatives = 0
-    true_positives = 0
-    false_positives = 0
-    for train_idx, test_idx in cv: 
-        features_train = []
-        features_test  = []
-        labels_train   = []
-        labels_test    = []
-        for ii in train_idx:
-            features_train.append( features[ii] )
-            labels_train.append( labels[ii] )
-        for jj in test_idx:
-            features_test.append( features[jj] )
-            labels_test.append( labels[jj] )
-        
-        ### fit the classifier using training set, and test on test set
-        clf.fit(features_train, labels_train)
-        predictions = clf.predict(features_test)
-        for prediction, truth in zip(predictions, labels_test):
-            if prediction == 0 and truth == 0:
-                true_negatives += 1
-            elif prediction == 0 and truth == 1:
-                false_negatives += 1
-            elif prediction == 1 and truth == 0:
-                false_positives += 1
-            elif prediction == 1 and truth == 1:
-                true_positives += 1
-            else:
-                print( "Warning: Found a predicted label not == 0 or 1.")
-                print( "All predictions should take value 0 or 1.")
-                print( "Evaluating performance for processed predictions:")
+    if tolerance is None:
+        results = run_folds(clf, features, labels, cv, n_jobs)
+    else:
+        results = []
+        splits = iter(cv)
+        while True:
+            batch = list(islice(splits, batch_size))
+            if not batch:
                 break
-    try:
-        total_predictions = true_negatives + false_negatives + false_positives + true_positives
-        accuracy = 1.0*(true_positives + true_negatives)/total_predictions
-        precision = 1.0*true_positives/(true_positives+false_positives)
-        recall = 1.0*true_positives/(true_positives+false_negatives)
-        f1 = 2.0 * true_positives/(2*true_positives + false_positives+false_negatives)
-        f2 = (1+2.0*2.0) * precision*recall/(4*precision + recall)
-        print(clf)
-        print(PERF_FORMAT_STRING.format(accuracy, precision, recall, f1, f2, display_precision = 5))
-        print(RESULTS_FORMAT_STRING.format(total_predictions, true_positives, false_positives, false_negatives, true_negatives))
-        print("")
-    except:
-        print("Got a divide by zero when trying out:", clf)
+            results += run_folds(clf, features, labels, batch, n_jobs)
+            if len(results) >= min_folds and \
+                    converged(evaluation_result(clf, results), tolerance):
+                break
+
+    result = evaluation_result(clf, results, folds)
+    if result.unexpected:
+        print( "Warning: Found a predicted label not == 0 or 1.")
+        print( "All predictions should take value 0 or 1.")
+        print( "Evaluating performance for processed predictions:")
+    result.report()
+    return result
 
 CLF_PICKLE_FILENAME = "my_classifier.pkl"
 DATASET_PICKLE_FILENAME = "my_dataset.pkl"
@@ -88,11 +265,13 @@ def load_classifier_and_data():
     feature_list = pickle.load(open(FEATURE_LIST_FILENAME, "r"))
     return clf, dataset, feature_list
 
-def main():
+def main(n_jobs = 1, tolerance = None):
     ### load up student's classifier, dataset, and feature_list
     clf, dataset, feature_list = load_classifier_and_data()
     ### Run testing script
-    test_classifier(clf, dataset, feature_list)
+    test_classifier(clf, dataset, feature_list, n_jobs = n_jobs,
+                    tolerance = tolerance)
 
 if __name__ == '__main__':
-    main()
+    ### python tester.py [n_jobs [tolerance]]
+    main(*[convert(arg) for convert, arg in zip((int, float), sys.argv[1:])])